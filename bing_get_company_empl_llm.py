@@ -1,10 +1,14 @@
 import os
-import requests
-from bs4 import BeautifulSoup
-import openai
+import asyncio
 from dotenv import load_dotenv
 from supabase import create_client, Client
-import time
+from fetch_engine import FetchEngine
+from html_text import TextExtractorPool
+from search_cache import SearchCache, MISSING
+from llm_batch import BatchJobWriter, batch_mode_from_argv, read_answers, fetch_companies_by_id
+from llm_client import LLMClient
+from scraper.sharding import countries_from_argv, report_progress
+from scraper.db import bulk_update
 
 # Load environment variables
 load_dotenv()
@@ -15,76 +19,111 @@ key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
 # Set up API keys
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 BING_SEARCH_V7_SUBSCRIPTION_KEY = os.environ.get("BING_SEARCH_V7_SUBSCRIPTION_KEY")
 BING_SEARCH_V7_ENDPOINT = os.environ.get("BING_SEARCH_V7_ENDPOINT", "https://api.bing.microsoft.com/v7.0/search")
 
-openai.api_key = OPENAI_API_KEY
+# Companies in flight at once, their page fetches are capped globally and per host by the FetchEngine
+COMPANY_CONCURRENCY = 20
+# Parallel Bing requests
+SEARCH_CONCURRENCY = 5
+# Characters of every result page that go into the prompt
+TEXT_PER_PAGE = 5000
+# Companies per LLM request, each brings up to 5 pages of text
+PACK_SIZE = 4
 
-def bing_search(query, num_results=5):
+search_slots = asyncio.Semaphore(SEARCH_CONCURRENCY)
+# Search results are shared with fetch_company_websites and kept across runs
+search_cache = SearchCache()
+
+async def bing_search(session, query, num_results=5):
+    # The cache is SQLite, its reads and writes run off the event loop
+    cached = await asyncio.to_thread(search_cache.get, query)
+    if cached is not MISSING:
+        return cached[:num_results]
 
     headers = {"Ocp-Apim-Subscription-Key": BING_SEARCH_V7_SUBSCRIPTION_KEY}
-    params = {"q": query, "count": num_results, "textDecorations": True, "textFormat": "HTML"}
-    response = requests.get(BING_SEARCH_V7_ENDPOINT, headers=headers, params=params)
-    response.raise_for_status()
-    search_results = response.json()
-    return search_results.get("webPages", {}).get("value", [])
-
-def extract_text_from_url(url, max_retries=2, backoff_factor=0.3):
-    for attempt in range(max_retries):
-        try:
-            response = requests.get(url, timeout=10)
+    params = {"q": query, "count": num_results, "textDecorations": "true", "textFormat": "HTML"}
+    async with search_slots:
+        async with session.get(BING_SEARCH_V7_ENDPOINT, headers=headers, params=params) as response:
             response.raise_for_status()
-            soup = BeautifulSoup(response.text, 'html.parser')
-            return soup.get_text()
-        except Exception as e:
-            if attempt + 1 == max_retries:
-                print(f"Failed to fetch {url} after {max_retries} attempts")
-                return ""
-            time.sleep(backoff_factor * (2 ** attempt))
-    return ""
+            search_results = await response.json()
+    results = search_results.get("webPages", {}).get("value", [])
+    # Empty results are not cached, the search is tried again on the next run
+    if results:
+        await asyncio.to_thread(search_cache.set, query, None, results)
+    return results
 
-def get_employee_count(website):
-    query = f"How many people work at {website}"
-    search_results = bing_search(query)
-    
-    texts = []
-    for item in search_results:
-        url = item['url']
-        text = extract_text_from_url(url)
-        texts.append(text[:5000])
-    
+async def extract_text_from_url(engine, extractor, url):
+    html = await engine.fetch(url)
+    if html is None:
+        return ""
+    # Parsed in the extractor's worker processes, at most TEXT_PER_PAGE characters are extracted
+    return await extractor.extract(html)
+
+def employee_count_messages(website, texts):
     combined_text = "\n\n".join(texts)
     
     prompt = f"Based on the following text, how many employees work at {website} worldwide? Please respond with only a number. If you can't find a specific number, respond with 'Unknown'.\n\n{combined_text}"
     
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that extracts employee counts from text."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    content = response.choices[0].message.content.strip()
+    return [
+        {"role": "system", "content": "You are a helpful assistant that extracts employee counts from text."},
+        {"role": "user", "content": prompt}
+    ]
+
+EMPLOYEE_COUNT_INSTRUCTIONS = """
+    You are a helpful assistant that extracts employee counts from text.
+    Every input is a website and text about it. Based on the text, how many employees work at the company
+    of the website worldwide? Please respond with only a number. If you can't find a specific number, respond with 'Unknown'.
+"""
+
+def employee_count_question(website, texts):
+    combined_text = "\n\n".join(texts)
+    return f"Website: {website}\n\n{combined_text}"
+
+def parse_employee_count(content):
     if content.isdigit():
         return int(content)
     else:
         return None
 
-def fetch_companies(page=0, page_size=1000):
-    return supabase.table('eudamed_companies').select('*')\
-        .eq('iso_code', 'AT')\
+async def get_page_texts(engine, extractor, website):
+    query = f"How many people work at {website}"
+    search_results = await bing_search(engine.session, query)
+    
+    # All result pages are fetched at once
+    return await asyncio.gather(*[extract_text_from_url(engine, extractor, item['url']) for item in search_results])
+
+async def get_employee_count(engine, extractor, counter, website):
+    # Answer of the LLM (packed with other companies), None if it gave none
+    texts = await get_page_texts(engine, extractor, website)
+    return await counter.ask(employee_count_question(website, texts))
+
+def fetch_companies(iso_codes=None, last_id=None, page_size=1000):
+    # Keyset pagination on id, processed companies leave the filter while we page
+    query = supabase.table('eudamed_companies').select('*')\
         .eq('eudamed_type', 'MF')\
         .not_.is_('website', 'null')\
-        .neq('scraping_status', 'GOT_EMPL_WEBSITE')\
-        .range(page*page_size, (page+1)*page_size-1)\
-        .execute()
+        .neq('scraping_status', 'GOT_EMPL_WEBSITE')
+    # ISO codes are passed on the command line, e.g. python bing_get_company_empl_llm.py AT DE (default AT, --all for every country)
+    if iso_codes:
+        query = query.in_('iso_code', iso_codes)
+    if last_id:
+        query = query.gt('id', last_id)
+    return query.order('id').limit(page_size).execute()
 
-def process_company(company):
+async def process_company(engine, extractor, company, counter=None, job=None):
     website = company['website']
+    if website and job is not None:
+        # --write-batch: the prompt goes into the job, the company is updated by --apply-batch
+        job.add(company['id'], employee_count_messages(website, await get_page_texts(engine, extractor, website)))
+        return
     if website:
-        employee_count = get_employee_count(website)
+        answer = await get_employee_count(engine, extractor, counter, website)
+        if answer is None:
+            # No answer, the company is picked up again on the next run
+            print(f"No answer for company: {company['name']}")
+            return
+        employee_count = parse_employee_count(answer)
         update_data = {
             "empl_website": employee_count,
             "scraping_status": "GOT_EMPL_WEBSITE"
@@ -94,26 +133,74 @@ def process_company(company):
             "scraping_status": "GOT_EMPL_WEBSITE"
         }
     
-    supabase.table('eudamed_companies').update(update_data).eq('id', company['id']).execute()
+    await asyncio.to_thread(supabase.table('eudamed_companies').update(update_data).eq('id', company['id']).execute)
     print(f"Processed company: {company['name']} - Employee count: {employee_count if 'empl_website' in update_data else 'N/A'}")
 
-def process_all_companies():
-    page = 0
+async def company_worker(engine, extractor, queue, progress, counter=None, job=None):
     while True:
-        companies = fetch_companies(page)
-        if not companies.data:
-            break
-        
-        for company in companies.data:
-            process_company(company)
+        company = await queue.get()
+        try:
+            await process_company(engine, extractor, company, counter, job)
+            progress['companies'] += 1
+            report_progress(**progress)
+        except Exception as e:
+            # The status is left as is, so the company is picked up again on the next run
+            print(f"Error processing company {company['id']}: {e}")
+        finally:
+            queue.task_done()
+
+async def process_all_companies(iso_codes=None, job=None):
+    queue = asyncio.Queue(COMPANY_CONCURRENCY * 2)
+    progress = {"companies": 0}
 
+    with TextExtractorPool(max_chars=TEXT_PER_PAGE) as extractor:
+        async with FetchEngine() as engine, LLMClient() as llm:
+            counter = llm.packed(EMPLOYEE_COUNT_INSTRUCTIONS, pack_size=PACK_SIZE)
+            workers = [asyncio.create_task(company_worker(engine, extractor, queue, progress, counter, job)) for _ in range(COMPANY_CONCURRENCY)]
+
+            last_id = None
+            while True:
+                companies = await asyncio.to_thread(fetch_companies, iso_codes, last_id)
+                if not companies.data:
+                    break
             
-        
-        page += 1
+                for company in companies.data:
+                    await queue.put(company)
+
+                last_id = companies.data[-1]['id']
 
-        
+            await queue.join()
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
     
-    print("Finished processing all companies.")
+    print(f"Finished processing all companies. Total processed: {progress['companies']}")
+    print(search_cache.stats())
+    print(llm.stats())
+
+def write_batch(iso_codes, path):
+    # Search and page texts are gathered as usual, only the question goes into the job
+    with BatchJobWriter(path) as job:
+        asyncio.run(process_all_companies(iso_codes, job))
+    print(f"Wrote {job.count} requests to {', '.join(job.paths) or 'no file'}")
+
+def apply_batch(path):
+    answers = read_answers(path)
+    companies = fetch_companies_by_id(supabase, answers, 'id')
+    rows = [{
+        "id": company['id'],
+        "empl_website": parse_employee_count(answers[company['id']]),
+        "scraping_status": "GOT_EMPL_WEBSITE"
+    } for company in companies]
+    bulk_update('eudamed_companies', rows)
+    print(f"Updated {len(rows)} companies, {sum(1 for row in rows if row['empl_website'] is not None)} with an employee count")
 
 # Run the script
-process_all_companies()
\ No newline at end of file
+if __name__ == "__main__":
+    mode, path = batch_mode_from_argv()
+    if mode == "write":
+        write_batch(countries_from_argv("AT"), path)
+    elif mode == "apply":
+        apply_batch(path)
+    else:
+        asyncio.run(process_all_companies(countries_from_argv("AT")))
@@ -1,7 +1,13 @@
 import os
+import asyncio
 from dotenv import load_dotenv
 from supabase import create_client, Client
-import openai
+from persistent_cache import PersistentCache
+from url_normalizer import has_domain, normalize_website
+from scraper.sharding import countries_from_argv, report_progress
+from scraper.db import bulk_update
+from llm_batch import BatchJobWriter, batch_mode_from_argv, read_answers, fetch_companies_by_id
+from llm_client import LLMClient
 
 # Load environment variables
 load_dotenv()
@@ -11,66 +17,157 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
-# OpenAI setup
-openai.api_key = os.environ.get("OPENAI_API_KEY")
+# Website values per LLM request
+PACK_SIZE = 50
 
+# Cleaned website by raw website value, kept across runs (cache/clean_url_hosts.sqlite3).
+# Renamed from clean_url, whose entries were cut down to the registrable domain.
+url_cache = PersistentCache('clean_url_hosts')
 
-def fetch_companies(page=0, page_size=1000):
-    return supabase.table('eudamed_companies').select('*')\
-        .neq("scraping_status", "CLEANED_WEBSITE") \
-        .eq("iso_code", "CH") \
-        .range(page*page_size, (page+1)*page_size-1)\
-        .execute()
 
-def clean_website(website):
+def fetch_companies(iso_codes=None, last_id=None, page_size=1000):
+    # Keyset pagination on id, cleaned companies leave the filter while we page
+    query = supabase.table('eudamed_companies').select('*')\
+        .neq("scraping_status", "CLEANED_WEBSITE")
+    # ISO codes are passed on the command line, e.g. python clean_url.py CH AT (default CH, --all for every country)
+    if iso_codes:
+        query = query.in_("iso_code", iso_codes)
+    if last_id:
+        query = query.gt("id", last_id)
+    return query.order("id").limit(page_size).execute()
 
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": """
-                You are a helpful assistant that cleans up website URLs but does not change the url itself. 
-                You will be provided with domain a value such as "http://www.domain.com or domain.at" and 
-                should only return 1 url that looks like this domain.com. 
-                Do not change the name or spelling of the domain itself - just clean it up. 
-                If in the value there are more than 1 domain, pick the more international one and always only 
-                return one. 
-            """},
-            {"role": "user", "content": website}
-        ]
-    )
+CLEAN_URL_INSTRUCTIONS = """
+    You are a helpful assistant that cleans up website URLs but does not change the url itself. 
+    You will be provided with domain a value such as "http://www.domain.com or domain.at" and 
+    should only return 1 url that looks like this domain.com. 
+    Do not change the name or spelling of the domain itself - just clean it up. 
+    If in the value there are more than 1 domain, pick the more international one and always only 
+    return one. 
+"""
 
-    return response.choices[0].message.content.strip()
+def clean_url_messages(website):
+    return [
+        {"role": "system", "content": CLEAN_URL_INSTRUCTIONS},
+        {"role": "user", "content": website}
+    ]
 
-def process_company(company):
+def parse_clean_url(answer):
+    # The answer goes through the normalizer too, "www.Domain.com/" -> "domain.com"
+    return normalize_website(answer) or answer
 
+async def clean_websites(websites, cleaner=None):
+    # {raw: cleaned} - from the cache, else the local normalizer, the LLM (a packed prompt) only for what it can't handle.
+    # Without a cleaner, or when the LLM gives no answer, the values that need the LLM are left out.
+    cleaned = url_cache.get_many(websites)
+    new = {}
+    ask = []
+
+    for website in dict.fromkeys(websites):
+        if website in cleaned:
+            continue
+        if not has_domain(website):
+            # "n/a", "No website", ...
+            new[website] = None
+        else:
+            result = normalize_website(website)
+            if result is None:
+                ask.append(website)
+            else:
+                new[website] = result
+
+    by_rules = len(new)
+    if ask and cleaner is not None:
+        answers = await asyncio.gather(*[cleaner.ask(website) for website in ask], return_exceptions=True)
+        for website, answer in zip(ask, answers):
+            if isinstance(answer, str):
+                new[website] = parse_clean_url(answer)
+
+    cleaned.update(new)
+    if new:
+        url_cache.set_many(new)
+    print(f"Cleaned {len(set(websites))} websites: {len(set(websites)) - by_rules - len(ask)} cached, {by_rules} by rules, {len(new) - by_rules} by the LLM, {len(ask) - len(new) + by_rules} left pending")
+    return cleaned
+
+def company_update(company, cleaned):
     if company['website'] is None:
-        update_data = {
-            "scraping_status": "CLEANED_WEBSITE"
-        }
+        website, original_website = None, company.get('original_website')
     else:
-        cleaned_website = clean_website(company['website'])
-        update_data = {
-            "website": cleaned_website,
-            "original_website": company['website'],
-            "scraping_status": "CLEANED_WEBSITE"
-        }
-    
-    supabase.table('eudamed_companies').update(update_data).eq('id', company['id']).execute()
-    print(f"Processed company: {company['name']} - Old: {company['website']} New Website: {cleaned_website if 'website' in update_data else 'N/A'}")
+        website, original_website = cleaned[company['website']], company['website']
+
+    return {
+        "id": company['id'],
+        "website": website,
+        "original_website": original_website,
+        "scraping_status": "CLEANED_WEBSITE"
+    }
 
-def process_all_companies():
+async def process_companies(companies, cleaner=None):
+    # Returns the companies that are left pending
+    cleaned = await clean_websites([company['website'] for company in companies if company['website'] is not None], cleaner)
+    done = [company for company in companies if company['website'] is None or company['website'] in cleaned]
+    if done:
+        rows = [company_update(company, cleaned) for company in done]
+        await asyncio.to_thread(bulk_update, 'eudamed_companies', rows)
+    return [company for company in companies if company['website'] is not None and company['website'] not in cleaned]
+
+async def process_all_companies(iso_codes=None, cleaner=None):
+    total_processed = 0
+    last_id = None
     while True:
-        companies = fetch_companies(0)
+        companies = await asyncio.to_thread(fetch_companies, iso_codes, last_id)
         if not companies.data:
             break
         
-        for company in companies.data:
-            process_company(company)
-        
+        await process_companies(companies.data, cleaner)
 
+        last_id = companies.data[-1]['id']
+        total_processed += len(companies.data)
+        print(f"Processed {total_processed} companies so far.")
+        report_progress(companies=total_processed)
     
     print("Finished processing all companies.")
 
+async def clean_all_companies(iso_codes=None):
+    async with LLMClient() as llm:
+        await process_all_companies(iso_codes, llm.packed(CLEAN_URL_INSTRUCTIONS, pack_size=PACK_SIZE))
+    print(llm.stats())
+
+async def write_batch(iso_codes, path):
+    # Everything the cache / rules can clean is updated right away, the rest goes into the job,
+    # one request per distinct website value
+    seen = set()
+    last_id = None
+    with BatchJobWriter(path) as job:
+        while True:
+            companies = await asyncio.to_thread(fetch_companies, iso_codes, last_id)
+            if not companies.data:
+                break
+
+            for company in await process_companies(companies.data):
+                if company['website'] not in seen:
+                    seen.add(company['website'])
+                    job.add(company['id'], clean_url_messages(company['website']))
+
+            last_id = companies.data[-1]['id']
+
+    print(f"Wrote {job.count} requests to {', '.join(job.paths) or 'no file'}")
+
+async def apply_batch(iso_codes, path):
+    # The answers go into the cache, then every pending company is cleaned from the cache
+    answers = read_answers(path)
+    companies = await asyncio.to_thread(fetch_companies_by_id, supabase, answers, 'id, website')
+    url_cache.set_many({
+        company['website']: parse_clean_url(answers[company['id']])
+        for company in companies if company['website'] is not None
+    })
+    await process_all_companies(iso_codes)
+
 # Run the script
 if __name__ == "__main__":
-    process_all_companies()
\ No newline at end of file
+    mode, path = batch_mode_from_argv()
+    if mode == "write":
+        asyncio.run(write_batch(countries_from_argv("CH"), path))
+    elif mode == "apply":
+        asyncio.run(apply_batch(countries_from_argv("CH"), path))
+    else:
+        asyncio.run(clean_all_companies(countries_from_argv("CH")))
\ No newline at end of file
@@ -1,7 +1,20 @@
 import os
 import csv
+import sys
+import gzip
+import json
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from scraper.sharding import iso_codes_from_argv
+
+# Parquet export needs pyarrow, CSV / JSON Lines work without it
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 # Load environment variables
 load_dotenv()
@@ -11,46 +24,226 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
-# Function to fetch companies with pagination
-def fetch_companies(page_size=1000):
-    companies = []
-    start = 0
-    while True:
-        response = supabase.table("eudamed_companies").select("*").range(start, start + page_size - 1).execute()
-        
-        if response.data is None or len(response.data) == 0:
-            break
-        
-        companies.extend(response.data)
-        
-        if len(response.data) < page_size:
-            break
-        
-        start += page_size
-        print(f"Fetched {len(companies)} companies so far...")
-    
-    return companies
-
-# Fetch all companies
-print("Fetching companies...")
-all_companies = fetch_companies()
-print(f"Total companies fetched: {len(all_companies)}")
-
-# Define the CSV file name
-csv_file = "eudamed_companies.csv"
-
-# Write data to CSV
-print(f"Writing data to {csv_file}...")
-with open(csv_file, mode='w', newline='', encoding='utf-8') as file:
-    if all_companies:
-        fieldnames = all_companies[0].keys()
-        writer = csv.DictWriter(file, fieldnames=fieldnames)
-        
-        # Write the header
-        writer.writeheader()
-        
-        # Write the data
-        for company in all_companies:
-            writer.writerow(company)
-
-print(f"Data has been saved to {csv_file}")
\ No newline at end of file
+# Raw EUDAMED payloads, only exported with --all-columns or when listed in --columns
+JSON_COLUMNS = {"json_dump"}
+
+PAGE_SIZE = 1000
+# Rows per Parquet row group
+ROW_GROUP_SIZE = 50000
+
+USAGE = """Usage: python eudame_companies_to_csv.py [ISO ...] [--output=eudamed_companies.csv] [--columns=id,name,...] [--all-columns]
+Format by extension of the output: .csv, .csv.gz, .jsonl, .jsonl.gz, .parquet"""
+
+
+def option(name, argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    prefix = f"--{name}="
+    for arg in argv:
+        if arg.startswith(prefix):
+            return arg[len(prefix):]
+    return None
+
+def export_columns(columns=None, all_columns=False):
+    # The listed columns, else every column of the table (one row tells which) without the JSON payloads
+    if columns:
+        return columns
+    sample = supabase.table("eudamed_companies").select("*").limit(1).execute()
+    if not sample.data:
+        return []
+    return [column for column in sample.data[0] if all_columns or column not in JSON_COLUMNS]
+
+def fetch_page(columns, iso_codes=None, last_id=None, page_size=PAGE_SIZE):
+    # Keyset pagination on id, id is always selected to page on
+    query = supabase.table("eudamed_companies").select(",".join(dict.fromkeys(["id", *columns])))
+    if iso_codes:
+        query = query.in_("iso_code", iso_codes)
+    if last_id:
+        query = query.gt("id", last_id)
+    return query.order("id").limit(page_size).execute().data or []
+
+def fetch_companies(columns, iso_codes=None, page_size=PAGE_SIZE):
+    # Yields the table page by page, the next page is fetched while the current one is written
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        page = executor.submit(fetch_page, columns, iso_codes, None, page_size)
+        while True:
+            rows = page.result()
+            if not rows:
+                break
+            if len(rows) == page_size:
+                page = executor.submit(fetch_page, columns, iso_codes, rows[-1]["id"], page_size)
+            yield rows
+            if len(rows) < page_size:
+                break
+
+def flat_value(value):
+    # Nested values (JSON columns) are written as JSON text
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, (dict, list)) else value
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode="wt", newline="", encoding="utf-8")
+    return open(path, mode="w", newline="", encoding="utf-8")
+
+
+class CsvExport:
+    def __init__(self, path, columns):
+        self.file = open_text(path)
+        self.columns = columns
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, rows):
+        self.writer.writerows([[flat_value(row.get(column)) for column in self.columns] for row in rows])
+
+    def close(self):
+        self.file.close()
+
+
+class JsonLinesExport:
+    def __init__(self, path, columns):
+        self.file = open_text(path)
+        self.columns = columns
+
+    def write(self, rows):
+        self.file.writelines(json.dumps({column: row.get(column) for column in self.columns}, ensure_ascii=False) + "\n" for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+# Arrow types of the Postgres column types PostgREST reports, everything else is exported as text
+PG_TYPES = {
+    "smallint": "int16",
+    "integer": "int32",
+    "bigint": "int64",
+    "real": "float32",
+    "double precision": "float64",
+    "numeric": "float64",
+    "boolean": "bool_",
+}
+JSON_TYPES = {"json", "jsonb"}
+
+def column_types(table="eudamed_companies"):
+    # {column: Postgres type} from the OpenAPI description PostgREST serves at /rest/v1/
+    response = requests.get(f"{url}/rest/v1/", headers={"apikey": key, "Authorization": f"Bearer {key}"}, timeout=30)
+    response.raise_for_status()
+    properties = response.json().get("definitions", {}).get(table, {}).get("properties", {})
+    return {column: spec.get("format", "") for column, spec in properties.items()}
+
+
+class ParquetExport:
+    """
+    Writes row groups of ROW_GROUP_SIZE rows. The schema comes from the table's
+    column types; JSON, arrays and all non-numeric types are stored as text.
+    Columns the table description doesn't list get the type of their first
+    non-empty values. Values that don't fit their column (12.5 in an integer
+    column, a bool in a text column) raise instead of being converted.
+    """
+
+    def __init__(self, path, columns):
+        if pa is None:
+            raise SystemExit("Parquet export needs pyarrow: pip install pyarrow")
+        self.path = path
+        self.columns = columns
+        self.types = column_types()
+        self.fields = {}
+        self.writer = None
+        self.rows = []
+
+    def write(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= ROW_GROUP_SIZE:
+            self.flush()
+
+    def field_type(self, column, values):
+        pg_type = self.types.get(column)
+        if pg_type is not None:
+            return getattr(pa, PG_TYPES[pg_type])() if pg_type in PG_TYPES else pa.string()
+        inferred = values.type
+        return None if pa.types.is_null(inferred) else inferred
+
+    def column_array(self, column, values):
+        if self.types.get(column) in JSON_TYPES:
+            values = [None if value is None else json.dumps(value, ensure_ascii=False) for value in values]
+        else:
+            values = [flat_value(value) for value in values]
+        try:
+            array = pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError(f"Column {column}: mixed value types ({e})")
+        if column not in self.fields:
+            self.fields[column] = self.field_type(column, array)
+        target = self.fields[column]
+        if target is None or array.type == target:
+            return array
+        # Only empty values, and integers into floating point / wider integers, are converted
+        if pa.types.is_null(array.type) or (pa.types.is_integer(array.type) and (pa.types.is_floating(target) or pa.types.is_integer(target))):
+            return array.cast(target, safe=True)
+        raise ValueError(f"Column {column}: {array.type} values don't fit its {target} type")
+
+    def flush(self):
+        rows, self.rows = self.rows, []
+        if not rows:
+            return
+        arrays = {column: self.column_array(column, [row.get(column) for row in rows]) for column in self.columns}
+        if self.writer is None:
+            # Columns without a known type and without values so far are text
+            for column in self.columns:
+                if self.fields[column] is None:
+                    self.fields[column] = pa.string()
+                    arrays[column] = arrays[column].cast(pa.string())
+            self.writer = pq.ParquetWriter(self.path, pa.schema([pa.field(column, self.fields[column]) for column in self.columns]), compression="zstd")
+        self.writer.write_table(pa.table(arrays, schema=self.writer.schema))
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+        elif self.columns:
+            # Empty export, still a valid file
+            pq.write_table(pa.table({column: pa.array([], pa.string()) for column in self.columns}), self.path)
+
+
+def exporter_for(path):
+    if path.endswith(".parquet"):
+        return ParquetExport
+    if path.endswith((".jsonl", ".jsonl.gz")):
+        return JsonLinesExport
+    if path.endswith((".csv", ".csv.gz")):
+        return CsvExport
+    raise SystemExit(f"Unknown export format of {path}\n{USAGE}")
+
+def export_companies(path, columns=None, iso_codes=None, all_columns=False):
+    """
+    Streams eudamed_companies to path, page by page, so memory use doesn't grow
+    with the table. The file is written as .part-<name> next to path and renamed once complete.
+    """
+    exporter = exporter_for(path)
+    columns = export_columns(columns, all_columns)
+    directory, name = os.path.split(path)
+    partial = os.path.join(directory, f".part-{name}")
+    export = exporter(partial, columns)
+    total = 0
+    try:
+        for rows in fetch_companies(columns, iso_codes):
+            export.write(rows)
+            total += len(rows)
+            print(f"Exported {total} companies so far...")
+    finally:
+        export.close()
+    os.replace(partial, path)
+    print(f"{total} companies have been saved to {path}")
+
+
+if __name__ == "__main__":
+    if "--help" in sys.argv:
+        print(USAGE)
+        sys.exit(0)
+    columns = option("columns")
+    export_companies(
+        option("output") or "eudamed_companies.csv",
+        columns=[column.strip() for column in columns.split(",") if column.strip()] if columns else None,
+        # ISO codes are passed on the command line, e.g. python eudame_companies_to_csv.py DE AT (default is every country)
+        iso_codes=iso_codes_from_argv(),
+        all_columns="--all-columns" in sys.argv,
+    )
\ No newline at end of file
@@ -1,85 +1,176 @@
 import os
+import asyncio
 import requests
 from dotenv import load_dotenv
 from supabase import create_client, Client
-import openai
 from bs4 import BeautifulSoup
+from search_cache import SearchCache, MISSING
+from scraper.sharding import iso_codes_from_argv
+from scraper.db import bulk_update
+from llm_batch import BatchJobWriter, batch_mode_from_argv, read_answers, fetch_companies_by_id
+from llm_client import LLMClient
 
 load_dotenv()
 
 # Set up API keys and clients
-OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 SUPABASE_URL = os.environ.get("SUPABASE_URL")
 SUPABASE_KEY = os.environ.get("SUPABASE_KEY")
 BING_SEARCH_V7_SUBSCRIPTION_KEY = os.environ.get("BING_SEARCH_V7_SUBSCRIPTION_KEY")
 BING_SEARCH_V7_ENDPOINT = os.environ.get("BING_SEARCH_V7_ENDPOINT")
 
-openai.api_key = OPENAI_API_KEY
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# Parallel Bing requests
+SEARCH_CONCURRENCY = 5
+# Companies per LLM request
+PACK_SIZE = 20
+
+SEARCH_MARKET = "en-US"
+# Search results are shared with bing_get_company_empl_llm and kept across runs
+search_cache = SearchCache()
+search_slots = asyncio.Semaphore(SEARCH_CONCURRENCY)
+
 def bing_search(query):
-    headers = {"Ocp-Apim-Subscription-Key": BING_SEARCH_V7_SUBSCRIPTION_KEY}
-    params = {"q": query, "count": 5, "offset": 0, "mkt": "en-US"}
-    response = requests.get(BING_SEARCH_V7_ENDPOINT, headers=headers, params=params)
-    response.raise_for_status()
-    search_results = response.json()
-    return [result['url'] for result in search_results.get("webPages", {}).get("value", [])]
-
-def verify_website_with_llm(company_name, urls):
-    # print(f"Verifying websites for {company_name}: {urls}")
+    results = search_cache.get(query, SEARCH_MARKET)
+    if results is MISSING:
+        headers = {"Ocp-Apim-Subscription-Key": BING_SEARCH_V7_SUBSCRIPTION_KEY}
+        params = {"q": query, "count": 5, "offset": 0, "mkt": SEARCH_MARKET}
+        response = requests.get(BING_SEARCH_V7_ENDPOINT, headers=headers, params=params)
+        response.raise_for_status()
+        results = response.json().get("webPages", {}).get("value", [])
+        # Empty results are not cached, the search is tried again on the next run
+        if results:
+            search_cache.set(query, SEARCH_MARKET, results)
+    return [result['url'] for result in results]
+
+def website_messages(company_name, urls):
     urls_str = "\n".join(urls)
     prompt = f"Given the company name '{company_name}' and the following list of URLs:\n\n{urls_str}\n\nWhich URL is most likely to be the official website for the company? If none of them seem to be the official website, respond with 'N/A'. Please provide only the domain (with the format 'example.com' (no www and no http)) or 'N/A' as your answer, with no additional explanation."
-    
-    response = openai.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that verifies company websites."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-
-    content = response.choices[0].message.content.strip()
+    return [
+        {"role": "system", "content": "You are a helpful assistant that verifies company websites."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_website(content):
     return content if content.lower() != 'n/a' else None
 
-def fetch_and_update_company_websites():
-    batch_size = 1000
-    offset = 0
-
-    while True:
-        # Fetch companies from Supabase
-        companies = supabase.table("eudamed_companies").select("*").eq("iso_code", "CH").is_("website", "null").neq("scraping_status", "SEARCHED_FOR_WEBSITE").range(offset, offset + batch_size - 1).execute()
-        
-        if not companies.data:
-            break  # No more companies to process
-
-        for company in companies.data:
-            company_name = company['name']
-            query = f"{company_name} official website"
-            search_results = bing_search(query)
-
-            if search_results:
-                # Verify the websites with LLM
-                verified_website = verify_website_with_llm(company_name, search_results)
-                
-                if verified_website:
-                    # Update the company record in Supabase
-                    supabase.table("eudamed_companies").update({
-                        "website": verified_website,
-                        "scraping_status": "SEARCHED_FOR_WEBSITE"
-                    }).eq("id", company['id']).execute()
-                    print(f"Updated {company_name} with website: {verified_website}")
+WEBSITE_INSTRUCTIONS = """
+    You are a helpful assistant that verifies company websites.
+    Every input is a company name and a list of URLs. Which URL is most likely to be the official website for the company?
+    If none of them seem to be the official website, respond with 'N/A'. Please provide only the domain
+    (with the format 'example.com' (no www and no http)) or 'N/A' as your answer, with no additional explanation.
+"""
+
+def website_question(company_name, urls):
+    urls_str = "\n".join(urls)
+    return f"Company name: {company_name}\nURLs:\n{urls_str}"
+
+async def verify_website_with_llm(verifier, company_name, urls):
+    # print(f"Verifying websites for {company_name}: {urls}")
+    return await verifier.ask(website_question(company_name, urls))
+
+def fetch_companies(iso_codes, last_id=None, page_size=1000):
+    # Keyset pagination on id, so paging also works while the statuses don't change (--write-batch)
+    query = supabase.table("eudamed_companies").select("*").in_("iso_code", iso_codes).is_("website", "null").neq("scraping_status", "SEARCHED_FOR_WEBSITE")
+    if last_id:
+        query = query.gt("id", last_id)
+    return query.order("id").limit(page_size).execute()
+
+def mark_searched(company):
+    supabase.table("eudamed_companies").update({
+        "scraping_status": "SEARCHED_FOR_WEBSITE"
+    }).eq("id", company['id']).execute()
+
+def website_update(company, website):
+    return {
+        "id": company['id'],
+        "website": website,
+        "scraping_status": "SEARCHED_FOR_WEBSITE"
+    }
+
+async def process_company(verifier, company):
+    # Update row of the company, None if it stays pending (no answer from the LLM)
+    company_name = company['name']
+    async with search_slots:
+        search_results = await asyncio.to_thread(bing_search, f"{company_name} official website")
+
+    if not search_results:
+        print(f"No website found for {company_name}")
+        return website_update(company, None)
+
+    # Verify the websites with LLM
+    answer = await verify_website_with_llm(verifier, company_name, search_results)
+    if answer is None:
+        return None
+
+    verified_website = parse_website(answer)
+    if verified_website:
+        print(f"Updated {company_name} with website: {verified_website}")
+    else:
+        print(f"Could not verify website for {company_name}")
+    return website_update(company, verified_website)
+
+async def fetch_and_update_company_websites(iso_codes):
+    last_id = None
+
+    async with LLMClient() as llm:
+        verifier = llm.packed(WEBSITE_INSTRUCTIONS, pack_size=PACK_SIZE)
+        while True:
+            # Fetch companies from Supabase
+            companies = await asyncio.to_thread(fetch_companies, iso_codes, last_id)
+
+            if not companies.data:
+                break  # No more companies to process
+
+            results = await asyncio.gather(*[process_company(verifier, company) for company in companies.data], return_exceptions=True)
+            rows = []
+            for company, result in zip(companies.data, results):
+                if isinstance(result, Exception):
+                    # The status is left as is, so the company is picked up again on the next run
+                    print(f"Error processing company {company['id']}: {result}")
+                elif result is not None:
+                    rows.append(result)
+            await asyncio.to_thread(bulk_update, 'eudamed_companies', rows)
+
+            last_id = companies.data[-1]['id']
+
+    print(llm.stats())
+
+def write_batch(iso_codes, path):
+    # Companies without search results are marked right away, the others go into the job
+    last_id = None
+    with BatchJobWriter(path) as job:
+        while True:
+            companies = fetch_companies(iso_codes, last_id)
+            if not companies.data:
+                break
+
+            for company in companies.data:
+                search_results = bing_search(f"{company['name']} official website")
+                if search_results:
+                    job.add(company['id'], website_messages(company['name'], search_results))
                 else:
-                    print(f"Could not verify website for {company_name}")
-                    supabase.table("eudamed_companies").update({
-                        "scraping_status": "SEARCHED_FOR_WEBSITE"
-                    }).eq("id", company['id']).execute()
-            else:
-                print(f"No website found for {company_name}")
-                supabase.table("eudamed_companies").update({
-                    "scraping_status": "SEARCHED_FOR_WEBSITE"
-                }).eq("id", company['id']).execute()
-            
-            
+                    mark_searched(company)
+
+            last_id = companies.data[-1]['id']
+
+    print(f"Wrote {job.count} requests to {', '.join(job.paths) or 'no file'}")
+
+def apply_batch(path):
+    answers = read_answers(path)
+    companies = fetch_companies_by_id(supabase, answers, 'id')
+    rows = [website_update(company, parse_website(answers[company['id']])) for company in companies]
+    bulk_update('eudamed_companies', rows)
+    print(f"Updated {len(rows)} companies, {sum(1 for row in rows if row['website'])} with a website")
 
 if __name__ == "__main__":
-    fetch_and_update_company_websites()
+    # ISO codes are passed on the command line, e.g. python fetch_company_websites.py CH AT (default is CH)
+    iso_codes = iso_codes_from_argv() or ["CH"]
+    mode, path = batch_mode_from_argv()
+    if mode == "write":
+        write_batch(iso_codes, path)
+    elif mode == "apply":
+        apply_batch(path)
+    else:
+        asyncio.run(fetch_and_update_company_websites(iso_codes))
+    print(search_cache.stats())
@@ -0,0 +1,88 @@
+import asyncio
+import aiohttp
+from urllib.parse import urlsplit
+
+# Some sites answer bots with an error page, look like a browser
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36"
+
+
+class FetchEngine:
+    """
+    Async page fetcher for the enrichment scrapers.
+
+    One aiohttp session for the whole run with a global cap on concurrent fetches
+    (max_connections) and at most per_host fetches per host. Every fetch has a hard
+    deadline that starts once it has a slot, so a slow site can only cost its own
+    deadline. Bodies are read in chunks and reading stops after max_bytes.
+
+    Usage:
+        async with FetchEngine() as engine:
+            html = await engine.fetch(url)
+    """
+
+    def __init__(self, max_connections=100, per_host=2, deadline=10, max_bytes=256 * 1024, retries=2, backoff=0.3):
+        self.max_connections = max_connections
+        self.per_host = per_host
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.backoff = backoff
+        self.slots = asyncio.Semaphore(max_connections)
+        self.host_slots = {}
+        self.session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=self.deadline, sock_read=self.deadline),
+            headers={"User-Agent": USER_AGENT},
+        )
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def host_slot(self, url):
+        host = urlsplit(url).hostname or ""
+        if host not in self.host_slots:
+            self.host_slots[host] = asyncio.Semaphore(self.per_host)
+        return self.host_slots[host]
+
+    async def read(self, url):
+        async with self.session.get(url, allow_redirects=True) as response:
+            response.raise_for_status()
+            body = bytearray()
+            async for chunk in response.content.iter_chunked(16 * 1024):
+                body += chunk
+                if len(body) >= self.max_bytes:
+                    break
+            return bytes(body[:self.max_bytes])
+
+    async def fetch(self, url):
+        # First max_bytes of the body, None if the page can't be fetched.
+        # Only connection errors and 5xx are retried, a site that ran out of its deadline or answered 4xx is not.
+        for attempt in range(self.retries):
+            try:
+                async with self.host_slot(url), self.slots:
+                    return await asyncio.wait_for(self.read(url), self.deadline)
+            except asyncio.TimeoutError:
+                print(f"Timed out fetching {url} after {self.deadline} seconds")
+                return None
+            except aiohttp.ClientResponseError as e:
+                if e.status < 500:
+                    print(f"Failed to fetch {url}: HTTP {e.status}")
+                    return None
+            except (aiohttp.ClientError, ValueError):
+                pass
+
+            if attempt + 1 < self.retries:
+                await asyncio.sleep(self.backoff * (2 ** attempt))
+
+        print(f"Failed to fetch {url} after {self.retries} attempts")
+        return None
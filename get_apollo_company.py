@@ -7,6 +7,8 @@ import string
 import uuid
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from rate_limiter import ApolloRateLimiter, parse_retry_after
+from scraper.sharding import countries_from_argv, report_progress
 
 # Load environment variables
 load_dotenv()
@@ -20,6 +22,12 @@ supabase: Client = create_client(supabase_url, supabase_key)
 APOLLO_API_KEY = os.environ.get("APOLLO_API_KEY")
 APOLLO_API_URL = "https://api.apollo.io/v1/organizations/enrich"
 
+# Shared by all requests, follows the quota Apollo reports in its response headers
+apollo_limiter = ApolloRateLimiter(rate=1.0)
+
+class ApolloRequestFailed(Exception):
+    pass
+
 
 
 # async def fetch_sql(iso_code, batch_size=1000, from_=0):
@@ -62,37 +70,36 @@ async def fetch_apollo_data(session, domain):
     }
     params = {"domain": domain}
     
-    max_retries = 3
+    max_retries = 5
     retry_delay = 10
 
     for attempt in range(max_retries):
-        async with session.get(APOLLO_API_URL, headers=headers, params=params) as response:
-            if response.status == 200:
-                return await response.json()
-            elif response.status == 429:
-                if attempt < max_retries - 1:
-                    print(f"Rate limit reached for {domain}. Retrying in {retry_delay} seconds...")
-                    print(response.headers)
-                    exit(1)
+        await apollo_limiter.acquire()
+        try:
+            async with session.get(APOLLO_API_URL, headers=headers, params=params) as response:
+                apollo_limiter.update_from_headers(response.headers)
+
+                if response.status == 200:
+                    return await response.json()
+                elif response.status == 429:
+                    # Rate limited - wait as long as Apollo asks us to, then retry
+                    wait = parse_retry_after(response.headers.get('Retry-After')) or retry_delay * (attempt + 1)
+                    apollo_limiter.pause(wait)
+                    print(f"Rate limit reached for {domain}. Retrying in {wait:.0f} seconds...")
+                elif response.status in (401, 403):
+                    # Bad key or no credits left - don't record this company as "no data"
+                    raise ApolloRequestFailed(f"Apollo refused the request for {domain}. Status: {response.status}")
+                elif response.status >= 500:
+                    print(f"Apollo error for {domain}. Status: {response.status}. Retrying in {retry_delay} seconds...")
                     await asyncio.sleep(retry_delay)
-                    continue
                 else:
-                    print(f"Failed to fetch data for {domain} after {max_retries} attempts due to rate limiting.")
-                    print(response.headers)
-                    exit(1)
+                    print(f"Failed to fetch data for {domain}. Status: {response.status}")
                     return None
-            else:
-                # stop the program if this happens and print the response status and headers
-                print(f"Else - Failed to fetch data for {domain}. Status: {response.status}")
-                # print(response.headers)
-                print(response)
+        except aiohttp.ClientError as e:
+            print(f"Connection error for {domain}: {e}. Retrying in {retry_delay} seconds...")
+            await asyncio.sleep(retry_delay)
 
-                # stop the program
-                exit(1)
-
-                return None
-    
-    return None
+    raise ApolloRequestFailed(f"Failed to fetch data for {domain} after {max_retries} attempts")
 
 async def insert_apollo_company(eudamed_company_id, apollo_data):
     organization = apollo_data.get('organization', {})
@@ -181,7 +188,12 @@ async def process_company(session, company):
         print(f"{company['name']} has no website. Skipping.")
         return
 
-    apollo_data = await fetch_apollo_data(session, company['website'])
+    try:
+        apollo_data = await fetch_apollo_data(session, company['website'])
+    except ApolloRequestFailed as e:
+        # Leave the company as it is so the next run picks it up again
+        print(e)
+        return
 
     if apollo_data:
         await insert_apollo_company(company['id'], apollo_data)
@@ -200,16 +212,18 @@ async def process_company(session, company):
 
     await update_eudamed_company_status(company['id'])
 
-    # wait 2 sec - this is here so that apollo rate limiting is not triggered & it is here not in the process_all_companies so that it can first check if the company is already in the apollo_companies table
-    await asyncio.sleep(2)
-
 async def process_companies_batch(companies):
     async with aiohttp.ClientSession() as session:
         tasks = [process_company(session, company) for company in companies]
         await asyncio.gather(*tasks)
 
-async def process_all_companies(iso_code):
-    batch_size = 1
+async def get_country_iso_codes():
+    response = supabase.table('countries').select("iso_code").execute()
+    return [country['iso_code'] for country in response.data]
+
+async def process_all_companies(iso_code, progress=None):
+    # Requests are paced by apollo_limiter, the batch only bounds how many are queued at once
+    batch_size = 50
     from_ = 0
     total_processed = 0
 
@@ -223,6 +237,9 @@ async def process_all_companies(iso_code):
         await process_companies_batch(companies.data)
         
         total_processed += len(companies.data)
+        if progress is not None:
+            progress['companies'] += len(companies.data)
+            report_progress(**progress)
         
         # print(f"Processed {total_processed} companies so far.")
         
@@ -239,5 +256,15 @@ async def process_all_companies(iso_code):
         
     print(f"Finished processing all companies. Total processed: {total_processed}")
 
+async def process_all_countries():
+    # ISO codes are passed on the command line, e.g. python get_apollo_company.py FR DE (default FR, --all for every country)
+    iso_codes = countries_from_argv("FR") or await get_country_iso_codes()
+    progress = {"companies": 0}
+
+    for iso_code in iso_codes:
+        print(f"Processing companies in {iso_code}")
+        await process_all_companies(iso_code, progress)
+
 # Run the script
-asyncio.run(process_all_companies("FR"))  
\ No newline at end of file
+if __name__ == "__main__":
+    asyncio.run(process_all_countries())  
\ No newline at end of file
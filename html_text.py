@@ -0,0 +1,155 @@
+import re
+import asyncio
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor
+
+# libxml2 (through lxml) parses HTML in C, the stdlib parser is the fallback
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+# Elements whose content is never visible text
+SKIP_TAGS = {"script", "style", "noscript", "template", "svg"}
+
+# The body is parsed in slices of this size, so parsing stops soon after max_chars are collected
+FEED_SIZE = 16 * 1024
+
+WHITESPACE = re.compile(r"\s+")
+META_CHARSET = re.compile(rb"""<meta[^>]+charset=["']?([a-zA-Z0-9_-]+)""", re.IGNORECASE)
+
+
+def decode_html(html):
+    # Declared charset, else UTF-8 (the byte budget may have cut the last character), else cp1252
+    if isinstance(html, str):
+        return html
+    match = META_CHARSET.search(html[:4096])
+    if match:
+        try:
+            return html.decode(match.group(1).decode("ascii"), errors="replace")
+        except LookupError:
+            pass
+    try:
+        return html.decode("utf-8")
+    except UnicodeDecodeError as e:
+        if e.start >= len(html) - 3:
+            return html.decode("utf-8", errors="ignore")
+    return html.decode("cp1252", errors="replace")
+
+
+class TextCollector:
+    """
+    Parser target that keeps the visible text of a page, at most max_chars of it.
+    Works as lxml target and, through StdlibTextParser, with the stdlib parser.
+    """
+
+    def __init__(self, max_chars):
+        self.max_chars = max_chars
+        self.parts = []
+        self.size = 0
+        self.skip_depth = 0
+
+    @property
+    def full(self):
+        return self.size >= self.max_chars
+
+    def separate(self):
+        # Text of neighbouring elements must not run together
+        if self.parts and self.parts[-1] != " ":
+            self.parts.append(" ")
+
+    def start(self, tag, attrib=None):
+        self.separate()
+        if isinstance(tag, str) and tag.lower() in SKIP_TAGS:
+            self.skip_depth += 1
+
+    def end(self, tag):
+        self.separate()
+        if isinstance(tag, str) and tag.lower() in SKIP_TAGS and self.skip_depth:
+            self.skip_depth -= 1
+
+    def data(self, text):
+        if self.skip_depth or self.full:
+            return
+        text = WHITESPACE.sub(" ", text)
+        if text.strip():
+            self.parts.append(text)
+            self.size += len(text)
+
+    def comment(self, text):
+        pass
+
+    def close(self):
+        return WHITESPACE.sub(" ", "".join(self.parts)).strip()[:self.max_chars]
+
+
+class StdlibTextParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+
+    def handle_starttag(self, tag, attrs):
+        self.collector.start(tag)
+
+    def handle_endtag(self, tag):
+        self.collector.end(tag)
+
+    def handle_data(self, data):
+        self.collector.data(data)
+
+
+def html_to_text(html, max_chars=5000):
+    """
+    Visible text of an HTML page (bytes or str), without script / style content,
+    whitespace collapsed, at most max_chars long. Parsing stops once max_chars
+    are collected, the rest of the page is never parsed.
+    """
+    collector = TextCollector(max_chars)
+    html = decode_html(html)
+
+    if etree is not None:
+        parser = etree.HTMLParser(target=collector, recover=True, no_network=True)
+        for i in range(0, len(html), FEED_SIZE):
+            parser.feed(html[i:i + FEED_SIZE])
+            if collector.full:
+                break
+        try:
+            parser.close()
+        except etree.LxmlError:
+            pass
+        return collector.close()
+
+    parser = StdlibTextParser(collector)
+    for i in range(0, len(html), FEED_SIZE):
+        parser.feed(html[i:i + FEED_SIZE])
+        if collector.full:
+            break
+    return collector.close()
+
+
+class TextExtractorPool:
+    """
+    Runs html_to_text in worker processes, so parsing neither blocks the event
+    loop nor is serialized by the GIL.
+
+    Usage:
+        with TextExtractorPool() as extractor:
+            text = await extractor.extract(html)
+    """
+
+    def __init__(self, max_workers=None, max_chars=5000):
+        self.max_workers = max_workers
+        self.max_chars = max_chars
+        self.executor = None
+
+    def __enter__(self):
+        self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.executor.shutdown(cancel_futures=True)
+        self.executor = None
+
+    async def extract(self, html):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, html_to_text, html, self.max_chars)
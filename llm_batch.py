@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import openai
+from dotenv import load_dotenv
+
+# Offline mode of the LLM stages (clean_url, fetch_company_websites, bing_get_company_empl_llm)
+# through the OpenAI Batch API, instead of one chat completion after the other:
+#
+#   python clean_url.py CH --write-batch=jobs/clean_url_ch.jsonl     prompts of every pending company
+#   python llm_batch.py submit jobs/clean_url_ch.jsonl                 upload, prints the batch id
+#   python llm_batch.py status <batch_id>
+#   python llm_batch.py download <batch_id> jobs/clean_url_ch.out.jsonl
+#   python clean_url.py CH --apply-batch=jobs/clean_url_ch.out.jsonl  bulk update of eudamed_companies
+#
+# Every request's custom_id is the id of the company it belongs to.
+
+load_dotenv()
+openai.api_key = os.environ.get("OPENAI_API_KEY")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+MODEL = "gpt-4o-mini"
+
+# Batch API input file limits, larger jobs are split into part files
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+
+WRITE_FLAG = "--write-batch="
+APPLY_FLAG = "--apply-batch="
+
+
+def batch_mode_from_argv(argv=None):
+    # ("write", path) / ("apply", path) from --write-batch=... / --apply-batch=..., (None, None) for a normal run
+    argv = sys.argv[1:] if argv is None else argv
+    for arg in argv:
+        if arg.startswith(WRITE_FLAG):
+            return "write", arg[len(WRITE_FLAG):]
+        if arg.startswith(APPLY_FLAG):
+            return "apply", arg[len(APPLY_FLAG):]
+    return None, None
+
+
+class BatchJobWriter:
+    """
+    Writes chat completion requests to Batch API input files (JSONL).
+
+    Once a file reaches the API limits the next part is started:
+    job.jsonl, job.2.jsonl, job.3.jsonl, ... every part is submitted on its own.
+
+    Usage:
+        with BatchJobWriter('jobs/clean_url.jsonl') as job:
+            job.add(company['id'], messages)
+    """
+
+    def __init__(self, path, model=MODEL):
+        self.path = path
+        self.model = model
+        self.paths = []
+        self.count = 0
+        self.file = None
+        self.file_requests = 0
+        self.file_bytes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def part_path(self, part):
+        if part == 1:
+            return self.path
+        stem, ext = os.path.splitext(self.path)
+        return f"{stem}.{part}{ext}"
+
+    def add(self, custom_id, messages):
+        line = json.dumps({
+            "custom_id": str(custom_id),
+            "method": "POST",
+            "url": BATCH_ENDPOINT,
+            "body": {"model": self.model, "messages": messages},
+        }, ensure_ascii=False) + "\n"
+        size = len(line.encode("utf-8"))
+
+        if self.file is None or self.file_requests >= MAX_REQUESTS_PER_FILE or self.file_bytes + size > MAX_BYTES_PER_FILE:
+            self.close()
+            path = self.part_path(len(self.paths) + 1)
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self.file = open(path, "w", encoding="utf-8")
+            self.paths.append(path)
+            self.file_requests = self.file_bytes = 0
+
+        self.file.write(line)
+        self.file_requests += 1
+        self.file_bytes += size
+        self.count += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_answers(path):
+    """
+    {custom_id: answer text} of a Batch API output file. Failed requests and
+    lines that can't be read are left out, so their companies stay pending for
+    the next job.
+    """
+    answers = {}
+    failed = 0
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            try:
+                result = json.loads(line)
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    failed += 1
+                    continue
+                answers[result["custom_id"]] = response["body"]["choices"][0]["message"]["content"].strip()
+            except (ValueError, KeyError, IndexError, TypeError, AttributeError):
+                failed += 1
+
+    print(f"Read {len(answers)} answers from {path}, {failed} failed requests")
+    return answers
+
+
+def fetch_companies_by_id(supabase, ids, columns="*", chunk_size=200):
+    # The companies of a results file, ids are sent in chunks to keep the URL short
+    ids = list(ids)
+    companies = []
+    for i in range(0, len(ids), chunk_size):
+        response = supabase.table('eudamed_companies').select(columns).in_('id', ids[i:i + chunk_size]).execute()
+        companies.extend(response.data)
+    return companies
+
+
+def submit(path):
+    with open(path, "rb") as file:
+        uploaded = openai.files.create(file=file, purpose="batch")
+    batch = openai.batches.create(input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window="24h")
+    print(f"Submitted {path} as batch {batch.id}")
+
+
+def status(batch_id):
+    batch = openai.batches.retrieve(batch_id)
+    counts = batch.request_counts
+    print(f"Batch {batch.id}: {batch.status}, {counts.completed}/{counts.total} completed, {counts.failed} failed")
+    return batch
+
+
+def download(batch_id, path):
+    batch = status(batch_id)
+    if batch.output_file_id is None:
+        print("The batch has no output yet.")
+        return
+    with open(path, "w", encoding="utf-8") as file:
+        file.write(openai.files.content(batch.output_file_id).text)
+    print(f"Saved results to {path}")
+
+
+if __name__ == "__main__":
+    commands = {"submit": (submit, 1), "status": (status, 1), "download": (download, 2)}
+    if len(sys.argv) < 2 or sys.argv[1] not in commands or len(sys.argv) - 2 != commands[sys.argv[1]][1]:
+        print("Usage: python llm_batch.py submit <job.jsonl> | status <batch_id> | download <batch_id> <results.jsonl>")
+        sys.exit(1)
+    command, _ = commands[sys.argv[1]]
+    command(*sys.argv[2:])
@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import asyncio
+import openai
+from dotenv import load_dotenv
+from rate_limiter import RateLimiter
+
+load_dotenv()
+
+MODEL = "gpt-4o-mini"
+
+# USD per 1M input / output tokens
+PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Rough size of an answer, for the token budget before the real usage is known
+ESTIMATED_COMPLETION_TOKENS = 200
+
+# Appended to the instructions of a packed prompt
+PACK_FORMAT = """
+    You get a JSON object that maps ids to inputs. Handle every input on its own, exactly as described above.
+    Respond with a JSON object {"answers": {"<id>": "<answer>", ...}} with one string answer for every id.
+"""
+
+
+def estimate_tokens(messages):
+    # ~4 characters per token, good enough for client-side budgeting
+    return sum(len(message["content"]) for message in messages) // 4 + ESTIMATED_COMPLETION_TOKENS
+
+
+class LLMClient:
+    """
+    Async chat completions for the enrichment scripts.
+
+    At most max_in_flight requests run at once, and the client keeps under rpm / tpm
+    on its own instead of running into 429s. Every request has a timeout and is
+    retried on rate limits, timeouts, connection errors and 5xx. Tokens, cost and
+    latency of all requests are tracked, stats() sums them up.
+
+    The API key and endpoint come from OPENAI_API_KEY / OPENAI_BASE_URL, so a
+    local stub server can stand in for the API.
+
+    Usage:
+        async with LLMClient() as llm:
+            answer = await llm.complete(messages)
+            cleaner = llm.packed(instructions, pack_size=50)
+            cleaned = await cleaner.ask("http://www.domain.com")
+    """
+
+    def __init__(self, model=MODEL, max_in_flight=16, rpm=500, tpm=200000, timeout=60, retries=4):
+        self.model = model
+        self.retries = retries
+        self.slots = asyncio.Semaphore(max_in_flight)
+        # Requests and tokens per minute as two token buckets, both start full
+        self.request_budget = RateLimiter(rate=rpm / 60, burst=rpm)
+        self.token_budget = RateLimiter(rate=tpm / 60, burst=tpm)
+        self.client = openai.AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"), timeout=timeout, max_retries=0)
+        self.requests = 0
+        self.failures = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.latencies = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.client.close()
+
+    async def complete(self, messages, json_answer=False):
+        # Answer text of one chat completion, raises once the retries are used up
+        estimated = estimate_tokens(messages)
+        options = {"response_format": {"type": "json_object"}} if json_answer else {}
+
+        for attempt in range(self.retries + 1):
+            async with self.slots:
+                await self.request_budget.acquire()
+                await self.token_budget.acquire(estimated)
+                started = time.monotonic()
+                try:
+                    response = await self.client.chat.completions.create(model=self.model, messages=messages, **options)
+                except (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError) as e:
+                    self.failures += 1
+                    if attempt == self.retries:
+                        raise
+                    print(f"LLM request failed ({type(e).__name__}), retrying")
+                else:
+                    self.latencies.append(time.monotonic() - started)
+                    self.requests += 1
+                    usage = response.usage
+                    if usage is not None:
+                        self.prompt_tokens += usage.prompt_tokens
+                        self.completion_tokens += usage.completion_tokens
+                        self.token_budget.charge(usage.total_tokens - estimated)
+                    return response.choices[0].message.content.strip()
+
+            # Back off outside of the slot, so other requests keep going
+            await asyncio.sleep(2 ** attempt)
+
+    def packed(self, instructions, pack_size=20, max_wait=0.5):
+        return PackedPrompt(self, instructions, pack_size, max_wait)
+
+    @property
+    def cost(self):
+        input_price, output_price = PRICES.get(self.model, (0, 0))
+        return (self.prompt_tokens * input_price + self.completion_tokens * output_price) / 1_000_000
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        average = sum(latencies) / len(latencies) if latencies else 0
+        p95 = latencies[int(len(latencies) * 0.95)] if latencies else 0
+        return (f"LLM: {self.requests} requests ({self.failures} failed attempts), "
+                f"{self.prompt_tokens} prompt + {self.completion_tokens} completion tokens, ${self.cost:.4f}, "
+                f"latency avg {average:.2f}s / p95 {p95:.2f}s")
+
+
+class PackedPrompt:
+    """
+    Packs concurrent questions with the same instructions into one request with
+    a JSON answer. A pack is sent once it has pack_size questions or max_wait
+    seconds after its first one. Questions the model leaves out of its answer
+    are asked again on their own; ask() returns None if that fails too.
+    """
+
+    def __init__(self, llm, instructions, pack_size=20, max_wait=0.5):
+        self.llm = llm
+        self.instructions = instructions + PACK_FORMAT
+        self.pack_size = pack_size
+        self.max_wait = max_wait
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+
+    async def ask(self, question):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((question, future))
+        if len(self.pending) >= self.pack_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        pack, self.pending = self.pending, []
+        if pack:
+            task = asyncio.create_task(self.send(pack))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def send(self, pack):
+        messages = [
+            {"role": "system", "content": self.instructions},
+            {"role": "user", "content": json.dumps({str(i): question for i, (question, _) in enumerate(pack)}, ensure_ascii=False)}
+        ]
+        try:
+            content = await self.llm.complete(messages, json_answer=True)
+        except Exception as e:
+            for _, future in pack:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        try:
+            answers = json.loads(content).get("answers", {})
+        except (ValueError, AttributeError):
+            answers = {}
+
+        missing = []
+        for i, (question, future) in enumerate(pack):
+            answer = answers.get(str(i)) if isinstance(answers, dict) else None
+            if future.done():
+                # The caller was cancelled meanwhile
+                continue
+            if answer is not None:
+                future.set_result(str(answer).strip())
+            elif len(pack) > 1:
+                missing.append((question, future))
+            else:
+                future.set_result(None)
+
+        # Every left-out question gets a request of its own
+        await asyncio.gather(*[self.send([item]) for item in missing])
@@ -0,0 +1,21 @@
+-- get_company_id writes discovered companies as a bulk upsert on eudamed_uuid (UpsertBuffer),
+-- which needs a unique constraint on it. Duplicates left by the old SELECT + INSERT are merged
+-- into the row with the lowest id first, their references move to that row.
+begin;
+
+create temporary table company_duplicates on commit drop as
+select id, first_value(id) over (partition by eudamed_uuid order by id) as keep_id
+from eudamed_companies
+where eudamed_uuid is not null;
+
+delete from company_duplicates where id = keep_id;
+
+update eudamed_contactpeople t set company_id = d.keep_id from company_duplicates d where t.company_id = d.id;
+update eudamed_products t set company_id = d.keep_id from company_duplicates d where t.company_id = d.id;
+update eudamed_certificates t set company_id = d.keep_id from company_duplicates d where t.company_id = d.id;
+update apollo_companies t set eudamed_company_id = d.keep_id from company_duplicates d where t.eudamed_company_id = d.id;
+delete from eudamed_companies c using company_duplicates d where c.id = d.id;
+
+alter table eudamed_companies add constraint eudamed_companies_eudamed_uuid_key unique (eudamed_uuid);
+
+commit;
@@ -0,0 +1,12 @@
+-- get_company_devices upserts every device page on eudamed_uuid, which needs a unique constraint on it.
+-- Duplicate products are reduced to the row with the lowest id first.
+begin;
+
+delete from eudamed_products p
+using eudamed_products keep
+where p.eudamed_uuid = keep.eudamed_uuid
+  and p.id > keep.id;
+
+alter table eudamed_products add constraint eudamed_products_eudamed_uuid_key unique (eudamed_uuid);
+
+commit;
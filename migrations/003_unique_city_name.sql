@@ -0,0 +1,17 @@
+-- CityResolver creates unknown cities in one upsert on name, which needs a unique constraint on it.
+-- Duplicate cities are merged into the row with the lowest id first, their references move to that row.
+begin;
+
+create temporary table city_duplicates on commit drop as
+select id, first_value(id) over (partition by name order by id) as keep_id
+from cities;
+
+delete from city_duplicates where id = keep_id;
+
+update eudamed_companies t set city_id = d.keep_id from city_duplicates d where t.city_id = d.id;
+update eudamed_contactpeople t set city_id = d.keep_id from city_duplicates d where t.city_id = d.id;
+delete from cities c using city_duplicates d where c.id = d.id;
+
+alter table cities add constraint cities_name_key unique (name);
+
+commit;
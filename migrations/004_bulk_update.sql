@@ -0,0 +1,28 @@
+-- bulk_update(table_name, rows): update existing rows by id, every row with its own values (scraper/db.py bulk_update).
+-- rows is a JSON array of objects with id and the columns to set, all objects carry the same keys.
+-- Runs with the caller's rights, so it only needs UPDATE on the table, and never inserts.
+create or replace function bulk_update(table_name text, rows jsonb)
+returns void
+language plpgsql
+as $$
+declare
+    assignments text;
+begin
+    select string_agg(format('%I = r.%I', key, key), ', ')
+    into assignments
+    from (
+        select distinct jsonb_object_keys(element) as key
+        from jsonb_array_elements(rows) as elements(element)
+    ) as keys
+    where key <> 'id';
+
+    if assignments is null then
+        return;
+    end if;
+
+    execute format(
+        'update public.%I as t set %s from jsonb_populate_recordset(null::public.%I, $1) as r where t.id = r.id',
+        table_name, assignments, table_name
+    ) using rows;
+end;
+$$;
@@ -0,0 +1,5 @@
+-- The list stages store the versionNumber an entity has in the list endpoint, the detail stages
+-- select it to fetch (and cache) exactly that version. Existing rows start without one.
+alter table eudamed_companies add column if not exists listed_version_number integer;
+alter table eudamed_products add column if not exists listed_version_number integer;
+alter table eudamed_certificates add column if not exists listed_version_number integer;
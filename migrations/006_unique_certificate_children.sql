@@ -0,0 +1,21 @@
+-- get_certificate_details upserts the scopes and documents of a batch on (certificate_id, eudamed_uuid),
+-- which needs a unique constraint on both tables. Rows without a uuid are not affected (nulls are distinct).
+-- Duplicates from earlier reruns are reduced to one row per key first.
+begin;
+
+delete from certificate_scopes s
+using certificate_scopes keep
+where s.certificate_id = keep.certificate_id
+  and s.eudamed_uuid = keep.eudamed_uuid
+  and s.ctid > keep.ctid;
+
+delete from certificate_documents d
+using certificate_documents keep
+where d.certificate_id = keep.certificate_id
+  and d.eudamed_uuid = keep.eudamed_uuid
+  and d.ctid > keep.ctid;
+
+alter table certificate_scopes add constraint certificate_scopes_certificate_id_eudamed_uuid_key unique (certificate_id, eudamed_uuid);
+alter table certificate_documents add constraint certificate_documents_certificate_id_eudamed_uuid_key unique (certificate_id, eudamed_uuid);
+
+commit;
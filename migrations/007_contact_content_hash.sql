@@ -0,0 +1,29 @@
+-- get_company_details upserts contact people on content_hash, the sha256 of
+-- json.dumps([company_id, email, phone, first_name, family_name, position]) (contact_hash in get_company_details.py).
+-- Existing rows get the same hash, duplicates are reduced to one row per hash, then the unique index is created.
+begin;
+
+alter table eudamed_contactpeople add column if not exists content_hash text;
+
+update eudamed_contactpeople
+set content_hash = encode(sha256(convert_to(
+    '[' || concat_ws(',',
+        coalesce(to_json(company_id::text)::text, 'null'),
+        coalesce(to_json(email)::text, 'null'),
+        coalesce(to_json(phone)::text, 'null'),
+        coalesce(to_json(first_name)::text, 'null'),
+        coalesce(to_json(family_name)::text, 'null'),
+        coalesce(to_json(position)::text, 'null')
+    ) || ']',
+    'UTF8'
+)), 'hex')
+where content_hash is null;
+
+delete from eudamed_contactpeople c
+using eudamed_contactpeople keep
+where c.content_hash = keep.content_hash
+  and c.ctid > keep.ctid;
+
+create unique index if not exists eudamed_contactpeople_content_hash_key on eudamed_contactpeople (content_hash);
+
+commit;
@@ -0,0 +1,66 @@
+import os
+import json
+import sqlite3
+import threading
+
+# Local caches of the root scripts (cleaned URLs, ...), not checked in
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+MISSING = object()
+
+
+class PersistentCache:
+    """
+    Small key -> JSON value store in a SQLite file under cache/.
+
+    Survives restarts and is safe to share between threads and processes
+    (SQLite does the locking). get() returns MISSING for unknown keys, so
+    None can be cached as a value.
+
+    Usage:
+        cache = PersistentCache('clean_url')
+        value = cache.get(raw)
+        if value is MISSING:
+            cache.set(raw, compute(raw))
+    """
+
+    def __init__(self, name, directory=CACHE_DIR):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f"{name}.sqlite3")
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.connection.commit()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        return MISSING if row is None else json.loads(row[0])
+
+    def get_many(self, keys):
+        # {key: value} for the keys that are cached
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self.lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                for key, value in self.connection.execute(f"SELECT key, value FROM cache WHERE key IN ({placeholders})", chunk):
+                    found[key] = json.loads(value)
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, items):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO cache (key, value) VALUES (?, ?)",
+                [(key, json.dumps(value)) for key, value in items.items()]
+            )
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
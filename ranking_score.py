@@ -1,8 +1,10 @@
 import os
-import asyncio
-import aiohttp
+import numpy as np
+import pandas as pd
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from scraper.sharding import iso_codes_from_argv, report_progress
+from scraper.db import bulk_update
 
 # Load environment variables
 load_dotenv()
@@ -12,176 +14,135 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
-# EUDAMED API URL
-base_url = "https://ec.europa.eu/tools/eudamed/api/devices/basicUdiData/udiDiData"
-
-async def fetch_companies(batch_size=1000, from_=0):
-    return supabase.table('eudamed_companies') \
-        .select("id", "name", "empl_website") \
-        .eq("iso_code", "AT") \
-        .eq("eudamed_type", "MF") \
-        .neq("scraping_status", "UPDATED_RANKING_SCORE") \
-        .range(from_, from_ + batch_size - 1) \
-        .execute()
-
-
-async def update_company(id, update_data):
-        
-    # Remove None values from the update dictionary
-    details = {k: v for k, v in update_data.items() if v is not None}
-    
-    supabase.table('eudamed_companies').update(details).eq('id', id).execute()
-async def fetch_comp_products(uuid):
-    return supabase.table('eudamed_products') \
-        .select("id", "risk_class", "medicinal_product", "human_tissues", "animal_tissues", "human_product", "administering_medicine") \
-        .eq("company_id", uuid) \
-        .or_("legislation.eq.refdata.applicable-legislation.mdr,legislation.eq.refdata.applicable-legislation.mdd") \
-        .execute()
-
-async def fetch_apollo_company(company):
+# Scores a whole page of companies with one products query, one apollo query
+# and one bulk update instead of two queries and one update per company
+
+# Companies per page, keeps the in_() filters below the URL length limits
+BATCH_SIZE = 200
+# PostgREST returns at most this many rows per request
+MAX_ROWS = 1000
+
+RISK_CLASSES = {
+    "refdata.risk-class.class-i": "i",
+    "refdata.risk-class.class-iia": "iia",
+    "refdata.risk-class.class-iib": "iib",
+    "refdata.risk-class.class-iii": "iii",
+}
+PRODUCT_FLAGS = ["medicinal_product", "human_tissues", "animal_tissues", "human_product", "administering_medicine"]
+
+# (points per product, max points)
+PRODUCT_SCORES = {
+    "i": (1, 10),
+    "iia": (5, 20),
+    "iib": (7, 20),
+    "iii": (10, 30),
+    "medicinal_product": (1, 5),
+    "human_tissues": (5, 20),
+    "animal_tissues": (5, 20),
+    "human_product": (5, 20),
+    "administering_medicine": (1, 5),
+}
+
+def fetch_companies_page(iso_code=None, last_id=None, batch_size=BATCH_SIZE):
+    query = supabase.table('eudamed_companies') \
+        .select("id", "empl_website") \
+        .eq("eudamed_type", "MF")
+    if iso_code:
+        query = query.eq("iso_code", iso_code)
+    if last_id:
+        query = query.gt("id", last_id)
+    return query.order("id").limit(batch_size).execute().data
+
+def fetch_products_for_companies(company_ids):
+    rows = []
+    last_id = None
+    while True:
+        query = supabase.table('eudamed_products') \
+            .select("id", "company_id", "risk_class", *PRODUCT_FLAGS) \
+            .in_("company_id", company_ids) \
+            .in_("legislation", ["refdata.applicable-legislation.mdr", "refdata.applicable-legislation.mdd"])
+        if last_id:
+            query = query.gt("id", last_id)
+        data = query.order("id").limit(MAX_ROWS).execute().data
+        rows.extend(data)
+        if len(data) < MAX_ROWS:
+            return rows
+        last_id = data[-1]['id']
+
+def fetch_apollo_for_companies(company_ids):
     return supabase.table('apollo_companies') \
-        .select("id", "eudamed_company_id", "estimated_num_employees", "annual_revenue") \
-        .eq("eudamed_company_id", company['id']) \
-        .execute()
-
-async def ranking_score_products(company):
-    products = await fetch_comp_products(company['id'])
-
-    product_totals_score = {
-        "i": 0, # 1 max 10
-        "iia": 0, # 5 max 20
-        "iib": 0, # 7 max 20
-        "iii": 0, # 10 max 30
-        "medicinal_product": 0, # 1 max 5
-        "human_tissues": 0, # 5 max 20
-        "animal_tissues": 0, # 5 max 20
-        "human_product": 0, # 5 max 20
-        "administering_medicine": 0, # 1 max 5
-    }
-
-
-    for product in products.data:
-
-        # risk class
-        match product['risk_class']:
-            case "refdata.risk-class.class-i":
-                product_totals_score["i"] += 1
-            case "refdata.risk-class.class-iia":
-                product_totals_score["iia"] += 1
-            case "refdata.risk-class.class-iib":
-                product_totals_score["iib"] += 1
-            case "refdata.risk-class.class-iii":
-                product_totals_score["iii"] += 1
-            case _:
-                pass
-        
-        # medicinal product
-        if product['medicinal_product']:
-            product_totals_score["medicinal_product"] += 1
-        
-        # human tissues
-        if product['human_tissues']:
-            product_totals_score["human_tissues"] += 1
-        
-        # animal tissues
-        if product['animal_tissues']:
-            product_totals_score["animal_tissues"] += 1
-        
-        # human product
-        if product['human_product']:
-            product_totals_score["human_product"] += 1
-        
-        # administering medicine
-        if product['administering_medicine']:
-            product_totals_score["administering_medicine"] += 1
-        
-
-        
-
-
-    # Set the may limit and score 
-    ranking_score = 0
-    ranking_score += min(product_totals_score["i"] * 1, 10) # risk class i
-    ranking_score += min(product_totals_score["iia"] * 5, 20) # risk class iia
-    ranking_score += min(product_totals_score["iib"] * 7, 20) # risk class iib
-    ranking_score += min(product_totals_score["iii"] * 10, 30) # risk class iii
-    ranking_score += min(product_totals_score["medicinal_product"] * 1, 5) # medicinal product
-    ranking_score += min(product_totals_score["human_tissues"] * 5, 20) # human tissues
-    ranking_score += min(product_totals_score["animal_tissues"] * 5, 20) # animal tissues
-    ranking_score += min(product_totals_score["human_product"] * 5, 20) # human product
-    ranking_score += min(product_totals_score["administering_medicine"] * 1, 5) # administering medicine
-
-    return ranking_score
-
-async def ranking_score_rev_empl(company):
-    apollo_companies = await fetch_apollo_company(company)
-    apollo_company = apollo_companies.data[0] if apollo_companies.data else {}
-
-    ranking_score = 0
-
-    # Revenue * 0,00000002
-    annual_revenue_score = (apollo_company.get('annual_revenue') or 0) * 0.00000002
-
-    # Employees * 0.02
-    # check which empl_website (number written on website) or estimated_num_employees (from apollo) is higher and use that
-    empl_num = apollo_company.get('estimated_num_employees') or 0
-    if (company.get('empl_website') or 0) > empl_num:
-        empl_num = company.get('empl_website')
-    empl_score = (empl_num * 0.02)
-
-    ranking_score += min(annual_revenue_score, 20)
-    ranking_score += min(empl_score, 20)
-
-    return ranking_score
-
-async def process_company(session, company):
-
-    ranking_score = 0
-    ranking_score += await ranking_score_products(company)
-    ranking_score += await ranking_score_rev_empl(company)
-
-    # round to 2 decimal places
-    ranking_score = round(ranking_score, 2)
-
-    update_data = {
-        "ranking_score": ranking_score,
-        "scraping_status": "UPDATED_RANKING_SCORE"
-    }
-
-    await update_company(company['id'], update_data)
-
-    print(f"Risk score for {company['id']} {company['name']} to {ranking_score}")
-
-async def process_companies_batch(companies):
-    async with aiohttp.ClientSession() as session:
-        tasks = [process_company(session, company) for company in companies]
-        await asyncio.gather(*tasks)
-
-async def process_all_companies():
-    batch_size = 100
-    from_ = 0
+        .select("eudamed_company_id", "estimated_num_employees", "annual_revenue") \
+        .in_("eudamed_company_id", company_ids) \
+        .execute().data
+
+def score_companies(companies, products, apollo_companies):
+    """
+    Product score (points per risk class / flag, capped) plus revenue and employee score.
+    Takes lists of rows as returned by PostgREST and returns a Series of scores indexed by company id.
+    """
+    company_ids = pd.Index([company['id'] for company in companies], name="company_id")
+
+    # Products - count per class / flag and company, then apply points and caps
+    products = pd.DataFrame(products, columns=["company_id", "risk_class", *PRODUCT_FLAGS])
+    counts = pd.DataFrame({"company_id": products["company_id"]})
+    for risk_class in RISK_CLASSES.values():
+        counts[risk_class] = (products["risk_class"].map(RISK_CLASSES) == risk_class).astype(int)
+    for flag in PRODUCT_FLAGS:
+        counts[flag] = products[flag].fillna(False).astype(bool).astype(int)
+    counts = counts.groupby("company_id").sum().reindex(index=company_ids, columns=list(PRODUCT_SCORES), fill_value=0)
+
+    points = np.array([points for points, _ in PRODUCT_SCORES.values()])
+    caps = np.array([cap for _, cap in PRODUCT_SCORES.values()])
+    product_score = np.minimum(counts.to_numpy() * points, caps).sum(axis=1)
+
+    # Revenue and employees - first apollo row per company
+    apollo = pd.DataFrame(apollo_companies, columns=["eudamed_company_id", "estimated_num_employees", "annual_revenue"]) \
+        .drop_duplicates("eudamed_company_id") \
+        .set_index("eudamed_company_id") \
+        .reindex(company_ids)
+    annual_revenue = pd.to_numeric(apollo["annual_revenue"], errors="coerce").fillna(0).to_numpy()
+    apollo_empl = pd.to_numeric(apollo["estimated_num_employees"], errors="coerce").fillna(0).to_numpy()
+    website_empl = pd.to_numeric(pd.Series([company.get('empl_website') for company in companies]), errors="coerce").fillna(0).to_numpy()
+
+    rev_empl_score = np.minimum(annual_revenue * 0.00000002, 20) + np.minimum(np.maximum(apollo_empl, website_empl) * 0.02, 20)
+
+    return pd.Series(np.round(product_score + rev_empl_score, 2), index=company_ids, name="ranking_score")
+
+def write_scores(companies, scores):
+    # scraping_status is left alone, other stages may still be working on the company
+    rows = [{"id": company['id'], "ranking_score": float(scores[company['id']])} for company in companies]
+    bulk_update('eudamed_companies', rows)
+
+def process_all_companies_batch(iso_code=None, progress=None):
+    last_id = None
     total_processed = 0
 
     while True:
-        companies = await fetch_companies(batch_size, from_)
-        
-        if not companies.data:
-            print("No companies found.")
+        companies = fetch_companies_page(iso_code, last_id)
+        if not companies:
             break
-        
-        await process_companies_batch(companies.data)
-        
-        total_processed += len(companies.data)
-        # from_ += batch_size # not relevant now since we are updating the status of changed items in the db
-        
-        print(f"Processed {total_processed} companies so far.")
-        
-        if len(companies.data) < batch_size:
+
+        company_ids = [company['id'] for company in companies]
+        scores = score_companies(companies, fetch_products_for_companies(company_ids), fetch_apollo_for_companies(company_ids))
+        write_scores(companies, scores)
+
+        total_processed += len(companies)
+        print(f"Scored {total_processed} companies so far.")
+        if progress is not None:
+            progress['companies'] += len(companies)
+            report_progress(**progress)
+
+        if len(companies) < BATCH_SIZE:
             break
-        
+        last_id = companies[-1]['id']
+
     print(f"Finished processing all companies. Total processed: {total_processed}")
 
 # Run the script
-asyncio.run(process_all_companies())
+if __name__ == "__main__":
+    # Pass ISO codes to score other countries, e.g. python ranking_score.py AT DE (default is AT)
+    progress = {"companies": 0}
+    for iso_code in iso_codes_from_argv() or ["AT"]:
+        process_all_companies_batch(iso_code, progress)
 
 
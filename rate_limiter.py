@@ -0,0 +1,101 @@
+import time
+import asyncio
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    # Retry-After is either a number of seconds or an HTTP date
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RateLimiter:
+    """
+    Async token bucket shared by all tasks that call the same API.
+
+    acquire() waits for a token (or cost tokens at once, e.g. the estimated tokens
+    of an LLM request), charge() corrects such an estimate afterwards, pause()
+    blocks every caller for a while (e.g. on a 429 with Retry-After), and
+    update_from_headers() adjusts the rate to the quota the API reports, so we run
+    at the highest rate we are allowed to.
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate  # tokens per second
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0
+        self.lock = asyncio.Lock()
+
+    def set_rate(self, rate, burst=None):
+        if rate and rate > 0:
+            self.rate = rate
+        if burst:
+            self.burst = burst
+            self.tokens = min(self.tokens, burst)
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    def charge(self, tokens):
+        # Tokens used beyond (or, if negative, below) what acquire() took, a negative balance makes the next callers wait
+        self.tokens -= tokens
+
+    async def acquire(self, cost=1):
+        # A cost above the burst waits for a full bucket
+        cost = min(cost, self.burst)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= cost:
+                    self.tokens -= cost
+                    return
+
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+
+class ApolloRateLimiter(RateLimiter):
+    """
+    RateLimiter that follows Apollo's rate limit headers:
+    x-rate-limit-minute / x-minute-requests-left, x-hourly-requests-left,
+    x-24-hour-requests-left and Retry-After.
+    """
+
+    def update_from_headers(self, headers):
+        def header_int(name):
+            try:
+                return int(headers.get(name))
+            except (TypeError, ValueError):
+                return None
+
+        minute_limit = header_int('x-rate-limit-minute')
+        if minute_limit:
+            # Spread the per-minute quota evenly, allow a small burst
+            self.set_rate(minute_limit / 60, burst=max(1, minute_limit // 10))
+
+        if header_int('x-minute-requests-left') == 0:
+            self.pause(60)
+        if header_int('x-hourly-requests-left') == 0:
+            self.pause(15 * 60)
+        if header_int('x-24-hour-requests-left') == 0:
+            self.pause(60 * 60)
+
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        if retry_after:
+            self.pause(retry_after)
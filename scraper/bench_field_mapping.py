@@ -0,0 +1,65 @@
+import os
+import json
+import timeit
+from field_mapping import (
+    DEVICE_FIELDS, CERTIFICATE_FIELDS, COMPANY_FIELDS,
+    extract_device, extract_certificate, extract_company, map_batch, safe_get,
+)
+
+# Compares the compiled extractors with the safe_get path the stages used before:
+#   python scraper/bench_field_mapping.py
+
+SAMPLE_COMPANY = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eudamed_responses', 'company_details.json')
+BATCH = 300
+
+
+def safe_get_mapping(spec):
+    # One safe_get call per field, like update_product / update_certificate did
+    fields = []
+    for column, field in spec.items():
+        path, transform = (field, None) if isinstance(field, str) else field
+        fields.append((column, tuple(path.split(".")), transform))
+
+    def extract(payload):
+        row = {}
+        for column, keys, transform in fields:
+            value = safe_get(payload, *keys)
+            if transform is not None:
+                value = transform(value)
+            row[column] = value
+        return {k: v for k, v in row.items() if v is not None}
+
+    return extract
+
+
+def synthetic_payload(spec):
+    # Payload with a value at every mapped path
+    payload = {}
+    for i, field in enumerate(spec.values()):
+        path = field if isinstance(field, str) else field[0]
+        *parents, last = path.split(".")
+        node = payload
+        for key in parents:
+            node = node.setdefault(key, {})
+        node[last] = f"value-{i}"
+    return payload
+
+
+def bench(name, spec, extractor, payload):
+    payloads = [json.loads(json.dumps(payload)) for _ in range(BATCH)]
+    reference = safe_get_mapping(spec)
+    assert map_batch(reference, payloads) == map_batch(extractor, payloads), name
+
+    number = 20
+    old = min(timeit.repeat(lambda: map_batch(reference, payloads), number=number, repeat=5)) / number
+    new = min(timeit.repeat(lambda: map_batch(extractor, payloads), number=number, repeat=5)) / number
+    print(f"{name:<12} safe_get: {old * 1e3:7.3f} ms  compiled: {new * 1e3:7.3f} ms  per {BATCH} payloads  speedup: {old / new:4.1f}x")
+
+
+if __name__ == "__main__":
+    with open(SAMPLE_COMPANY, encoding='utf-8') as file:
+        company = json.load(file)
+
+    bench("device", DEVICE_FIELDS, extract_device, synthetic_payload(DEVICE_FIELDS))
+    bench("certificate", CERTIFICATE_FIELDS, extract_certificate, synthetic_payload(CERTIFICATE_FIELDS))
+    bench("company", COMPANY_FIELDS, extract_company, company)
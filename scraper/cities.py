@@ -0,0 +1,52 @@
+import asyncio
+from db import supabase, execute
+
+
+class CityResolver:
+    """
+    In-memory name -> id map of the cities table.
+
+    load() preloads every city once at startup, lookups are then served from the dict.
+    Unknown names are created in one bulk upsert on the unique name column, so
+    concurrent tasks (or processes) that meet the same new city don't insert duplicates.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.lock = asyncio.Lock()
+
+    async def load(self, page_size=1000):
+        from_ = 0
+        while True:
+            response = await execute(
+                supabase.table('cities')
+                .select('id', 'name')
+                .order('id')
+                .range(from_, from_ + page_size - 1)
+            )
+            for city in response.data:
+                self.ids[city['name']] = city['id']
+
+            if len(response.data) < page_size:
+                break
+            from_ += page_size
+
+        print(f"Loaded {len(self.ids)} cities.")
+
+    async def resolve(self, names):
+        # Returns {name: id} for all names, creating the unknown ones in bulk. Missing names (None / '') map to None
+        if any(name and name not in self.ids for name in names):
+            async with self.lock:
+                unknown = sorted({name for name in names if name and name not in self.ids})
+                if unknown:
+                    response = await execute(
+                        supabase.table('cities')
+                        .upsert([{'name': name} for name in unknown], on_conflict='name')
+                    )
+                    for city in response.data:
+                        self.ids[city['name']] = city['id']
+
+        return {name: self.ids.get(name) for name in names}
+
+    async def get_id(self, name):
+        return (await self.resolve([name]))[name]
@@ -0,0 +1,158 @@
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from postgrest.types import ReturnMethod
+
+# Load environment variables
+load_dotenv()
+
+# Supabase setup
+url: str = os.environ.get("SUPABASE_URL")
+key: str = os.environ.get("SUPABASE_KEY")
+supabase: Client = create_client(url, key)
+
+# The supabase client is synchronous, so every .execute() would block the event loop.
+# Queries are run in a bounded thread pool instead, so HTTP fetches and DB writes overlap.
+DB_MAX_WORKERS = int(os.environ.get("DB_MAX_WORKERS", 16))
+executor = ThreadPoolExecutor(max_workers=DB_MAX_WORKERS, thread_name_prefix="supabase")
+
+
+async def execute(query):
+    """
+    Run a PostgREST query builder without blocking the event loop.
+
+    Usage:
+        result = await execute(supabase.table('cities').select('id').eq('name', name))
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, query.execute)
+
+
+class UpsertBuffer:
+    """
+    Collects rows and writes them as one multi-row upsert instead of a round trip per row.
+
+    Rows are flushed once flush_size rows are buffered, every flush_interval seconds
+    while the buffer is open, and when the buffer is closed. The table needs a unique
+    constraint on the on_conflict column(s). Rows of a failed flush stay buffered;
+    if the final flush fails, closing the buffer raises.
+
+    Usage:
+        async with UpsertBuffer('eudamed_companies', on_conflict='eudamed_uuid', ignore_duplicates=True) as buffer:
+            await buffer.add(rows)
+    """
+
+    def __init__(self, table, on_conflict, flush_size=300, flush_interval=5.0, ignore_duplicates=False):
+        self.table = table
+        self.on_conflict = on_conflict
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.ignore_duplicates = ignore_duplicates
+        self.rows = []
+        self.written = 0
+        self.lock = asyncio.Lock()
+        self.timer = None
+
+    async def __aenter__(self):
+        if self.flush_interval:
+            self.timer = asyncio.create_task(self.flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        await self.flush()
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing {self.table}: {e}")
+
+    async def add(self, rows):
+        self.rows.extend(rows)
+        if len(self.rows) >= self.flush_size:
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            rows, self.rows = self.rows, []
+            if not rows:
+                return
+
+            # Postgres rejects an upsert that touches the same key twice, last row wins
+            keys = [column.strip() for column in self.on_conflict.split(",")]
+            rows = list({tuple(row.get(k) for k in keys): row for row in rows}.values())
+
+            try:
+                await execute(
+                    supabase.table(self.table)
+                    .upsert(rows, on_conflict=self.on_conflict, ignore_duplicates=self.ignore_duplicates, returning=ReturnMethod.minimal)
+                )
+            except Exception:
+                # Back in front of the buffer, the next flush (or the final one on close) writes them again
+                self.rows[:0] = rows
+                raise
+            self.written += len(rows)
+
+
+def bulk_update(table, rows, chunk_size=1000):
+    """
+    Update existing rows by id, every row with its own values, in one request per chunk.
+
+    Rows only hold id and the changed columns. Unlike an upsert on id this needs no INSERT
+    rights, doesn't re-create rows deleted meanwhile and leaves all other columns alone.
+    Runs the bulk_update function of migrations/004_bulk_update.sql. Synchronous, the
+    async stages call it through asyncio.to_thread.
+
+    Usage:
+        bulk_update('eudamed_companies', [{"id": company_id, "ranking_score": 4.2}, ...])
+    """
+    # The function sets every column a row carries, so rows with the same columns go together
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    for group in groups.values():
+        for i in range(0, len(group), chunk_size):
+            supabase.rpc('bulk_update', {"table_name": table, "rows": group[i:i + chunk_size]}).execute()
+
+
+async def iter_chunks(table, columns, where=None, chunk_size=1000):
+    """
+    Async iterator over the rows of a table in chunks of at most chunk_size rows.
+
+    Only the given columns are selected and pages are fetched by keyset on id
+    (id > last seen id), so rows that leave the filter while being processed
+    (e.g. a scraping_status update) don't shift the following pages.
+
+    Usage:
+        async for products in iter_chunks('eudamed_products', ['eudamed_uuid'],
+                                          lambda q: q.eq('scraping_status', 'GOT_COMPANY_DEVICES')):
+            ...
+    """
+    if 'id' not in columns:
+        columns = ['id', *columns]
+
+    last_id = None
+    while True:
+        query = supabase.table(table).select(*columns)
+        if where is not None:
+            query = where(query)
+        if last_id is not None:
+            query = query.gt('id', last_id)
+
+        response = await execute(query.order('id').limit(chunk_size))
+        if not response.data:
+            return
+
+        yield response.data
+
+        if len(response.data) < chunk_size:
+            return
+        last_id = response.data[-1]['id']
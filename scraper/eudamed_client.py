@@ -0,0 +1,154 @@
+import asyncio
+import aiohttp
+from urllib.parse import urlencode
+from json_codec import loads
+
+# EUDAMED API URL
+base_url = "https://ec.europa.eu/tools/eudamed/api"
+
+# Max page size the list endpoints accept (see workflow.md)
+MAX_PAGE_SIZE = 300
+
+
+class EudamedClient:
+    """
+    Shared async client for the EUDAMED API.
+
+    One instance keeps a single connection pool (keep-alive + DNS cache) for the
+    whole run, so the stages don't pay a new TLS handshake for every batch.
+
+    Detail responses (actor, device, certificate) are read from / written to
+    the optional on-disk ResponseCache.
+
+    Usage:
+        async with EudamedClient(cache=ResponseCache()) as client:
+            details = await client.get_actor(eudamed_uuid)
+    """
+
+    def __init__(self, limit=100, limit_per_host=20, timeout=30, retries=3, retry_delay=5, cache=None):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.cache = cache
+        self.session: aiohttp.ClientSession | None = None
+
+    async def __aenter__(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.limit,
+            limit_per_host=self.limit_per_host,
+            use_dns_cache=True,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=10),
+            headers={"Accept": "application/json"},
+        )
+        if self.cache is not None:
+            await self.cache.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+            if self.cache is not None:
+                await self.cache.close()
+
+    async def get_json(self, path, params=None, label=None):
+        # GET base_url + path and return the decoded JSON, or None after all retries failed.
+        # 5xx / 429 and bodies that aren't JSON (error pages) are retried, other 4xx are not.
+        url = f"{base_url}{path}"
+        label = label or path
+
+        for attempt in range(self.retries):
+            try:
+                async with self.session.get(url, params=params) as response:
+                    if 400 <= response.status < 500 and response.status != 429:
+                        print(f"HTTP {response.status} for {label}. Skipping.")
+                        return None
+                    response.raise_for_status()
+                    return loads(await response.read())
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+                if attempt < self.retries - 1:
+                    print(f"Request failed for {label}. Retrying in {self.retry_delay} seconds...")
+                    await asyncio.sleep(self.retry_delay)
+                else:
+                    print(f"Connection failed after {self.retries} attempts for {label}. Skipping.")
+
+        return None
+
+    async def get_cached_json(self, path, params=None, label=None, version=None):
+        # Same as get_json, but served from the response cache when it has this URL (and version)
+        if self.cache is None:
+            return await self.get_json(path, params, label)
+
+        key = f"{base_url}{path}?{urlencode(params or {})}"
+        data = await self.cache.get(key, version)
+        if data is None:
+            data = await self.get_json(path, params, label)
+            if data is not None:
+                await self.cache.set(key, data)
+        return data
+
+    # 1. Companies (economic operators) of a country
+    async def list_actors(self, iso_code: str, page: int = 0, page_size: int = MAX_PAGE_SIZE) -> dict | None:
+        # list of tuples so both sort keys are sent (a dict would drop the first one)
+        params = [
+            ("page", page),
+            ("pageSize", page_size),
+            ("size", page_size),
+            ("sort", "srn,ASC"),
+            ("sort", "versionNumber,DESC"),
+            ("countryIso2Code", iso_code),
+            ("languageIso2Code", "en"),
+        ]
+        return await self.get_json("/eos", params, label=f"{iso_code} page {page}")
+
+    # 2. Full company details incl. contact information
+    async def get_actor(self, eudamed_uuid: str, version: int | None = None) -> dict | None:
+        params = {"languageIso2Code": "en"}
+        return await self.get_cached_json(f"/actors/{eudamed_uuid}/publicInformation", params, eudamed_uuid, version)
+
+    # 3. Devices of an economic operator
+    async def list_devices(self, srn: str, page: int = 0, page_size: int = MAX_PAGE_SIZE) -> dict | None:
+        params = {
+            "page": page,
+            "pageSize": page_size,
+            "size": page_size,
+            "iso2Code": "en",
+            "srn": srn,
+            "languageIso2Code": "en"
+        }
+        return await self.get_json("/devices/udiDiData", params, label=f"{srn} page {page}")
+
+    # 4. Specific device data
+    async def get_device(self, eudamed_uuid: str, version: int | None = None) -> dict | None:
+        params = {"languageIso2Code": "en"}
+        return await self.get_cached_json(f"/devices/basicUdiData/udiDiData/{eudamed_uuid}", params, eudamed_uuid, version)
+
+    # 5. All countries
+    async def list_countries(self) -> list | None:
+        return await self.get_json("/countries", {"languageIso2Code": "en"})
+
+    # Certificates
+    async def list_certificates(self, page: int = 0, page_size: int = MAX_PAGE_SIZE) -> dict | None:
+        params = {
+            "page": page,
+            "pageSize": page_size,
+            "size": page_size,
+            "iso2Code": "en",
+            "entityTypeCode": "certificate.certificates",
+            "languageIso2Code": "en"
+        }
+        return await self.get_json("/certificates/search/", params, label=f"certificates page {page}")
+
+    async def get_certificate(self, eudamed_uuid: str, version: int | None = None) -> dict | None:
+        params = {"languageIso2Code": "en"}
+        return await self.get_cached_json(f"/certificates/{eudamed_uuid}", params, eudamed_uuid, version)
@@ -1,16 +1,8 @@
 import os
 import uuid
 import requests
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-# Load environment variables
-load_dotenv()
-
-# Supabase setup
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+from db import supabase
+from incremental import INCREMENTAL, is_changed
 
 # EUDAMED API URL
 base_url = "https://ec.europa.eu/tools/eudamed/api/certificates/search/"
@@ -37,16 +29,24 @@ def insert_certificate(certificate, counter):
     print(f"Certificate {counter}: {certificate['certificateNumber']}")
     
     # Check if the certificate already exists
-    existing = supabase.table('eudamed_certificates').select("eudamed_uuid").eq("eudamed_uuid", eudamed_uuid).execute()
+    existing = supabase.table('eudamed_certificates').select("id", "version_number", "scraping_status").eq("eudamed_uuid", eudamed_uuid).execute()
     
     if not existing.data:
         new_record = {
             "id": str(uuid.uuid4()),
             "eudamed_uuid": eudamed_uuid,
             "certificate_number": certificate['certificateNumber'],
+            "listed_version_number": certificate.get('versionNumber'),
             "scraping_status": "GOT_CERTIFICATE_ID"
         }
         supabase.table('eudamed_certificates').insert(new_record).execute()
+    elif INCREMENTAL and existing.data[0]['scraping_status'] != "GOT_CERTIFICATE_ID" \
+            and is_changed(existing.data[0], certificate.get('versionNumber')):
+        # Changed since the details were fetched - queue it for get_certificate_details again
+        supabase.table('eudamed_certificates').update({
+            "listed_version_number": certificate.get('versionNumber'),
+            "scraping_status": "GOT_CERTIFICATE_ID"
+        }).eq("id", existing.data[0]['id']).execute()
 
 def process_certificates():
     page = 0
@@ -1,131 +1,66 @@
-import os
+import json
 import uuid
 import asyncio
-import aiohttp
-from dotenv import load_dotenv
-from supabase import create_client, Client
-import json
-
-# Load environment variables
-load_dotenv()
+import hashlib
+from db import supabase, execute, iter_chunks, UpsertBuffer
+from eudamed_client import EudamedClient
+from response_cache import ResponseCache
+from cities import CityResolver
+from field_mapping import extract_company
+from json_codec import dumps
+from sharding import shard_filter, report_progress
 
-# Supabase setup
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+# Shared city name -> id cache, preloaded in process_all_companies
+cities = CityResolver()
 
-# EUDAMED API URL
-base_url = "https://ec.europa.eu/tools/eudamed/api/actors"
+# Max contacts per upsert, a batch of companies is usually written in one
+CONTACTS_FLUSH_SIZE = 1000
 
-async def fetch_company_details(session, eudamed_uuid):
-    url = f"{base_url}/{eudamed_uuid}/publicInformation?languageIso2Code=en"
-    
-    for attempt in range(3):  # Try up to 3 times
-        try:
-            async with session.get(url) as response:
-                return await response.json()
-        except aiohttp.ClientError:
-            if attempt < 2:  # If this is not the last attempt
-                print(f"Connection error for {eudamed_uuid}. Retrying in 5 seconds...")
-                await asyncio.sleep(5)  # Wait for 5 seconds before retrying
-            else:
-                print(f"Connection failed after 3 attempts for {eudamed_uuid}. Skipping this company.")
-                return None
-    
-    return None
+async def fetch_company_details(client, eudamed_uuid, version=None):
+    return await client.get_actor(eudamed_uuid, version)
 
 async def get_or_create_city(city_name):
-    existing_city = supabase.table('cities').select('id').eq('name', city_name).execute()
-    if existing_city.data:
-        return existing_city.data[0]['id']
-    else:
-        new_city = supabase.table('cities').insert({'name': city_name}).execute()
-        return new_city.data[0]['id']
+    return await cities.get_id(city_name)
 
 async def update_company(company_id, details):
     actor_data = details.get('actorDataPublicView', {})
     if not actor_data:
         print(f"Warning: No actorDataPublicView for company {company_id}")
-        supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company_id).execute()
+        await execute(supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company_id))
         return
 
     city_name = actor_data.get('actorAddress', {}).get('cityName', 'Unknown')
     city_id = await get_or_create_city(city_name)
     
     company_update = {
-        "json_dump": json.dumps(details),
-        "importers": json.dumps(details.get('importers')),
-        "non_eu_manufacturers": json.dumps(details.get('nonEuManufacturers')),
-        "eudamed_status": actor_data.get('actorStatus', {}).get('code') if actor_data.get('actorStatus') else None,
-        "iso_code": actor_data.get('actorAddress', {}).get('country', {}).get('iso2Code'),
+        "json_dump": dumps(details),
         "city_id": city_id,
-        "eudamed_type": actor_data.get('type', {}).get('srnCode') if actor_data.get('type') else None,
-        "trade_register": actor_data.get('tradeRegister'),
-        "eori": actor_data.get('eori'),
-        "european_vat_number": actor_data.get('europeanVatNumber'),
-        "eudamed_identifier": actor_data.get('eudamedIdentifier'),
-        "phone": actor_data.get('telephone'),
-        "email": actor_data.get('electronicMail'),
-        "original_website": actor_data.get('website'),
-        "validator_name": actor_data.get('validatorName'),
-        "validator_uuid": actor_data.get('validatorUuid'),
-        "validator_type": actor_data.get('validatorType', {}).get('srnCode') if actor_data.get('validatorType') else None,
-        "validator_srn": actor_data.get('validatorSrn'),
-        "validator_email": actor_data.get('validatorEmail'),
-        "validator_phone": actor_data.get('validatorTelephone'),
-        "actor_ulid": actor_data.get('ulid'),
-        "actor_version_number": actor_data.get('versionNumber'),
-        "actor_version_state": actor_data.get('versionState'),
-        "actor_latest_version": actor_data.get('latestVersion'),
-        "actor_last_update_date": actor_data.get('lastUpdateDate'),
-        "actor_names": json.dumps(actor_data.get('name')),
-        "actor_abbreviated_names": json.dumps(actor_data.get('abbreviatedName')),
-        "actor_status_from_date": actor_data.get('actorStatusFromDate'),
-        "actor_country_name": actor_data.get('country', {}).get('name'),
-        "actor_country_type": actor_data.get('country', {}).get('type'),
-        "actor_geographical_address": actor_data.get('geographicalAddress'),
-        "european_vat_number_applicable": actor_data.get('europeanVatNumberApplicable'),
-        "organization_identification_documents": json.dumps(actor_data.get('organizationIdentificationDocuments')),
-        "authorised_representatives": json.dumps(actor_data.get('authorisedRepresentatives')),
-        "competent_authority_responsibility": actor_data.get('competentAuthorityResponsibility'),
-        "actor_address": json.dumps(actor_data.get('actorAddress')),
-        "validator_address": json.dumps(actor_data.get('validatorAddress')),
-        "regulatory_compliance_responsibles": json.dumps(actor_data.get('regulatoryComplianceResponsibles')),
-        "legislation_links": json.dumps(actor_data.get('legislationLinks')),
-        "latest_subsidiary": json.dumps(actor_data.get('latestSubsidiary')),
-        "certificates": json.dumps(actor_data.get('certificates')),
-        "latest_version": actor_data.get('latestVersion'),
-        "version_number": actor_data.get('versionNumber'),
-        "version_state": json.dumps(actor_data.get('versionState')),
-        "last_update_date": actor_data.get('lastUpdateDate'),
-        "accuracy_data": json.dumps(actor_data.get('accuracyData')),
-        "last_accuracy_date": actor_data.get('lastAccuracyDate'),
+        # field_mapping.COMPANY_FIELDS
+        **extract_company(details),
         "scraping_status": "GOT_COMPANY_DETAILS"
     }
     
     # Remove None values from the update dictionary
     company_update = {k: v for k, v in company_update.items() if v is not None}
     
-    supabase.table('eudamed_companies').update(company_update).eq('id', company_id).execute()
-
-async def insert_contact_person(company_id, contact):
-    existing_contact = supabase.table('eudamed_contactpeople').select('id')\
-        .eq('company_id', company_id)\
-        .eq('email', contact.get('electronicMail'))\
-        .eq('phone', contact.get('telephone'))\
-        .eq('first_name', contact.get('firstName'))\
-        .eq('family_name', contact.get('familyName'))\
-        .eq('position', contact.get('position'))\
-        .execute()
-    
-    if existing_contact.data:
-        return
-
+    await execute(supabase.table('eudamed_companies').update(company_update).eq('id', company_id))
+
+def contact_hash(company_id, contact):
+    # Stable key of a contact person, the fields the old duplicate check compared
+    identity = [
+        company_id,
+        contact.get('electronicMail'),
+        contact.get('telephone'),
+        contact.get('firstName'),
+        contact.get('familyName'),
+        contact.get('position'),
+    ]
+    return hashlib.sha256(json.dumps(identity, separators=(',', ':'), ensure_ascii=False).encode('utf-8')).hexdigest()
+
+def contact_row(company_id, contact, city_id):
     geo_address = contact.get('geographicalAddress', {})
-    city_name = geo_address.get('cityName', 'Unknown')
-    city_id = await get_or_create_city(city_name)
-    
-    new_contact = {
+    return {
+        "content_hash": contact_hash(company_id, contact),
         "company_id": company_id,
         "first_name": contact.get('firstName'),
         "family_name": contact.get('familyName'),
@@ -135,65 +70,95 @@ async def insert_contact_person(company_id, contact):
         "city_id": city_id,
         "iso_code": geo_address.get('country', {}).get('iso2Code')
     }
-    
-    # Remove None values from the new_contact dictionary
-    new_contact = {k: v for k, v in new_contact.items() if v is not None}
-    
-    supabase.table('eudamed_contactpeople').insert(new_contact).execute()
 
-async def process_company(session, company):
-    details = await fetch_company_details(session, company['eudamed_uuid'])
+def contacts_buffer(flush_interval=None):
+    # Contacts are upserted on content_hash, a contact seen again (retry, rerun, concurrent task) is updated in place
+    return UpsertBuffer('eudamed_contactpeople', on_conflict='content_hash',
+                        flush_size=CONTACTS_FLUSH_SIZE, flush_interval=flush_interval)
+
+async def fetch_company(client, company, contacts):
+    # Returns the company's details and buffers its contacts, None if the company was marked ERROR
+    details = await fetch_company_details(client, company['eudamed_uuid'], company.get('listed_version_number'))
     
     if details is None:
         print(f"Error fetching details for company {company['id']}")
-        await supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']).execute()
+        await execute(supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']))
         return
 
     # Check for error response
     if 'httpStatusCode' in details:
         print(f"Error fetching details for company {company['id']}: {details['httpStatus']}")
-        await supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']).execute()
+        await execute(supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']))
         return
 
     actor_data = details.get('actorDataPublicView')
     if actor_data:
         regulatory_compliance = actor_data.get('regulatoryComplianceResponsibles')
+
+        # Resolve the company and contact cities in one go, new ones are created in bulk
+        city_names = [contact.get('geographicalAddress', {}).get('cityName', 'Unknown') for contact in regulatory_compliance or []]
+        city_names.append(actor_data.get('actorAddress', {}).get('cityName', 'Unknown'))
+        city_ids = await cities.resolve(city_names)
+
         if regulatory_compliance is not None:
-            for contact in regulatory_compliance:
-                await insert_contact_person(company['id'], contact)
+            await contacts.add([
+                contact_row(company['id'], contact, city_ids[city_name])
+                for contact, city_name in zip(regulatory_compliance, city_names)
+            ])
         else:
             print(f"No regulatory compliance responsibles for company {company['id']}")
-        
-        await update_company(company['id'], details)
+
+        return details
     else:
         print(f"Warning: No actorDataPublicView for company {company['id']}")
-        await supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']).execute()
-
-async def fetch_companies():
-    return supabase.table('eudamed_companies')\
-        .select('*')\
-        .neq("scraping_status", "GOT_COMPANY_DETAILS")\
-        .execute()
+        await execute(supabase.table('eudamed_companies').update({"scraping_status": "ERROR"}).eq('id', company['id']))
+
+async def process_companies_batch(client, companies, contacts):
+    # Returns the details of every company, None for the ones marked ERROR or left pending
+    results = await asyncio.gather(*[fetch_company(client, company, contacts) for company in companies])
+
+    # The contacts of the batch are written in one upsert before any status moves on, else a failed
+    # write loses them for good. On failure the batch keeps its status and is fetched again on the next run.
+    try:
+        await contacts.flush()
+    except Exception as e:
+        print(f"Error saving contacts of {len(companies)} companies: {e}")
+        return [None] * len(companies)
+
+    await asyncio.gather(*[
+        update_company(company['id'], details)
+        for company, details in zip(companies, results) if details is not None
+    ])
+    return results
+
+def fetch_companies(batch_size=25):
+    return iter_chunks(
+        'eudamed_companies',
+        ["id", "name", "eudamed_uuid", "listed_version_number"],
+        shard_filter(lambda query: query.neq("scraping_status", "GOT_COMPANY_DETAILS")),
+        batch_size
+    )
 
 async def process_all_companies():
-    async with aiohttp.ClientSession() as session:
-        while True:
-            response = await fetch_companies()
-            companies = response.data
-            if not companies:
-                break
-            
-            tasks = []
-            for company in companies[:5]:  # Process 5 companies at a time
+    await cities.load()
+    total_processed = 0
+
+    async with EudamedClient(cache=ResponseCache()) as client, contacts_buffer() as contacts:
+        async for companies in fetch_companies():
+            for company in companies:
                 print(f"Processing company: {company['name']} - {company['id']}")
-                tasks.append(process_company(session, company))
             
-            await asyncio.gather(*tasks)
+            await process_companies_batch(client, companies, contacts)
+
+            total_processed += len(companies)
+            print(f"Processed {total_processed} companies so far.")
+            report_progress(companies=total_processed)
     
-    print("Finished processing all companies.")
+    print(f"Finished processing all companies. Total processed: {total_processed}")
 
 # Run the script
-asyncio.run(process_all_companies())
+if __name__ == "__main__":
+    asyncio.run(process_all_companies())
 
 
 # Pseudo code
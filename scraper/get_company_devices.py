@@ -1,80 +1,74 @@
-import os
 import uuid
 import asyncio
-import aiohttp
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from db import supabase, execute, iter_chunks
+from postgrest.types import ReturnMethod
+from eudamed_client import EudamedClient
+from incremental import INCREMENTAL, fetch_known, is_changed
+from sharding import shard_filter, report_progress
 
-# Load environment variables
-load_dotenv()
+def fetch_companies(batch_size=50):
+    # With --incremental the device lists of all companies are compared again,
+    # only new or changed devices are queued for the details stage
+    statuses = ["GOT_COMPANY_DETAILS", "GOT_COMPANY_DEVICES"] if INCREMENTAL else ["GOT_COMPANY_DETAILS"]
+    return iter_chunks(
+        'eudamed_companies',
+        ["id", "eudamed_identifier"],
+        shard_filter(lambda query: query.in_("scraping_status", statuses)),
+        batch_size
+    )
 
-# Supabase setup
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
+async def fetch_devices(client, srn, page=0, page_size=300):
+    return await client.list_devices(srn, page, page_size)
 
-# EUDAMED API URL
-base_url = "https://ec.europa.eu/tools/eudamed/api/devices/udiDiData"
+def device_status(known_row, device):
+    # Unchanged devices keep their status with --incremental, everything else is (re)queued
+    if INCREMENTAL and known_row is not None and not is_changed(known_row, device.get('versionNumber')):
+        return known_row['scraping_status']
+    return "GOT_COMPANY_DEVICES"
 
-def fetch_companies(batch_size=1000, from_=0):
-    return supabase.table('eudamed_companies') \
-        .select("id", "eudamed_identifier") \
-        .eq("scraping_status", "GOT_COMPANY_DETAILS") \
-        .range(from_, from_ + batch_size - 1) \
-        .execute()
+async def upsert_devices(devices, company_id):
+    # One bulk upsert per page instead of a SELECT + UPDATE/INSERT per device
+    devices = list({device['uuid']: device for device in devices}.values())
+    if not devices:
+        return []
 
-async def fetch_devices(session, srn, page=0, page_size=300):
-    params = {
-        "page": page,
-        "pageSize": page_size,
-        "size": page_size,
-        "iso2Code": "en",
-        "srn": srn,
-        "languageIso2Code": "en"
-    }
-    async with session.get(base_url, params=params) as response:
-        return await response.json()
+    # Existing products keep their id, new ones get a fresh one
+    known = await fetch_known('eudamed_products', [device['uuid'] for device in devices])
 
-async def insert_or_update_device(device, company_id):
-    eudamed_uuid = device['uuid']
-    
-    # Check if the device already exists
-    existing_device = supabase.table('eudamed_products') \
-        .select("id") \
-        .eq("eudamed_uuid", eudamed_uuid) \
-        .execute()
-
-    if existing_device.data:
-        # Update existing device
-        updated_device = {
-            "name": device['tradeName'],
-            "company_id": company_id,
-            "scraping_status": "GOT_COMPANY_DEVICES"
-        }
-        supabase.table('eudamed_products') \
-            .update(updated_device) \
-            .eq("eudamed_uuid", eudamed_uuid) \
-            .execute()
-        print(f"Updated existing device: {eudamed_uuid}")
-    else:
-        # Insert new device
-        new_device = {
-            "id": str(uuid.uuid4()),
+    rows = [
+        {
+            "id": known[device['uuid']]['id'] if device['uuid'] in known else str(uuid.uuid4()),
             "name": device['tradeName'],
             "company_id": company_id,
-            "eudamed_uuid": eudamed_uuid,
-            "scraping_status": "GOT_COMPANY_DEVICES"
+            "eudamed_uuid": device['uuid'],
+            "listed_version_number": device.get('versionNumber'),
+            "scraping_status": device_status(known.get(device['uuid']), device)
         }
-        supabase.table('eudamed_products').insert(new_device).execute()
-        print(f"Inserted new device: {eudamed_uuid}")
+        for device in devices
+    ]
+    await execute(
+        supabase.table('eudamed_products')
+        .upsert(rows, on_conflict="eudamed_uuid", returning=ReturnMethod.minimal)
+    )
+    queued = sum(row['scraping_status'] == "GOT_COMPANY_DEVICES" for row in rows)
+    print(f"Upserted {len(rows)} devices for company {company_id} ({len(rows) - len(known)} new, {queued} queued for details)")
+    return rows
 
-async def process_company_devices(session, company):
+async def process_company_devices(client, company, products_queue=None):
+    # With a products_queue (pipeline.py) the devices queued for details are handed on right away
     page = 0
     while True:
-        data = await fetch_devices(session, company['eudamed_identifier'], page)
+        data = await fetch_devices(client, company['eudamed_identifier'], page)
+        if data is None or 'content' not in data:
+            print(f"Skipping devices for company {company['id']} due to connection issues.")
+            return
         
-        tasks = [insert_or_update_device(device, company['id']) for device in data['content']]
-        await asyncio.gather(*tasks)
+        rows = await upsert_devices(data['content'], company['id'])
+
+        if products_queue is not None:
+            for row in rows:
+                if row['scraping_status'] == "GOT_COMPANY_DEVICES":
+                    await products_queue.put(row)
         
         if data['last']:
             break
@@ -82,42 +76,33 @@ async def process_company_devices(session, company):
         page += 1
     
     # Update company scraping status
-    supabase.table('eudamed_companies') \
-        .update({"scraping_status": "GOT_COMPANY_DEVICES"}) \
-        .eq("id", company['id']) \
-        .execute()
+    await execute(
+        supabase.table('eudamed_companies')
+        .update({"scraping_status": "GOT_COMPANY_DEVICES"})
+        .eq("id", company['id'])
+    )
 
-async def process_companies_batch(companies):
-    async with aiohttp.ClientSession() as session:
-        tasks = [process_company_devices(session, company) for company in companies]
-        await asyncio.gather(*tasks)
+async def process_companies_batch(client, companies):
+    tasks = [process_company_devices(client, company) for company in companies]
+    await asyncio.gather(*tasks)
 
 async def process_all_companies():
-    batch_size = 50
-    from_ = 0
     total_processed = 0
 
-    while True:
-        companies = fetch_companies(batch_size, from_)
-        
-        if not companies.data:
-            print("No companies found.")
-            break
-        
-        await process_companies_batch(companies.data)
-        
-        total_processed += len(companies.data)
-        from_ += batch_size
-        
-        print(f"Processed {total_processed} companies so far.")
-        
-        if len(companies.data) < batch_size:
-            break
-        
-        
-        
+    async with EudamedClient() as client:
+        async for companies in fetch_companies():
+            await process_companies_batch(client, companies)
+            
+            total_processed += len(companies)
+            
+            print(f"Processed {total_processed} companies so far.")
+            report_progress(companies=total_processed)
+
+    if not total_processed:
+        print("No companies found.")
 
     print(f"Finished processing all companies. Total processed: {total_processed}")
 
 # Run the script
-asyncio.run(process_all_companies())
+if __name__ == "__main__":
+    asyncio.run(process_all_companies())
@@ -1,80 +1,133 @@
-import os
+import math
 import uuid
-import requests
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-# Load environment variables
-load_dotenv()
-
-# Supabase setup
-url: str = os.environ.get("SUPABASE_URL")
-key: str = os.environ.get("SUPABASE_KEY")
-supabase: Client = create_client(url, key)
-
-# EUDAMED API URL
-base_url = "https://ec.europa.eu/tools/eudamed/api/eos"
-
-def fetch_companies(iso_code, page=0, page_size=300):
-    params = {
-        "page": page,
-        "pageSize": page_size,
-        "size": page_size,
-        "rnd": 1718288423623,
-        "sort": "srn,ASC",
-        "sort": "versionNumber,DESC",
-        "countryIso2Code": iso_code,
-        "languageIso2Code": "en"
+import asyncio
+from db import supabase, execute, UpsertBuffer
+from eudamed_client import EudamedClient, MAX_PAGE_SIZE
+from incremental import INCREMENTAL, fetch_known, is_changed
+from sharding import iso_codes_from_argv, report_progress
+
+# Number of page jobs fetched in parallel
+CONCURRENCY = 10
+
+# Discovered companies are written in bulk: one upsert per FLUSH_SIZE rows,
+# or at the latest every FLUSH_INTERVAL seconds
+FLUSH_SIZE = 300
+FLUSH_INTERVAL = 5
+
+async def fetch_companies(client, iso_code, page=0, page_size=MAX_PAGE_SIZE):
+    return await client.list_actors(iso_code, page, page_size)
+
+async def count_companies(client, iso_code):
+    # Cheap size-1 query, only used for totalElements
+    data = await fetch_companies(client, iso_code, 0, 1)
+    if data is None:
+        print(f"Could not get company count for {iso_code}")
+        return 0
+    return data.get('totalElements', 0)
+
+def company_record(company):
+    return {
+        "id": str(uuid.uuid4()),
+        "name": company['name'],
+        "scraping_status": "GOT_COMPANY_ID",
+        "eudamed_uuid": company['uuid'],
+        "listed_version_number": company.get('versionNumber')
     }
-    response = requests.get(base_url, params=params)
-    return response.json()
-
-def insert_company(company, iso_code, counter):
-    eudamed_uuid = company['uuid']
-    
-    # Clear the terminal
-    os.system('cls' if os.name == 'nt' else 'clear')
-    
-    # Print country code and company name
-    print(f"Country Code: {iso_code}")
-    print(f"Company {counter}: {company['name']}")
-    
-    # Check if the company already exists
-    existing = supabase.table('eudamed_companies').select("eudamed_uuid").eq("eudamed_uuid", eudamed_uuid).execute()
-    
-    if not existing.data:
-        new_record = {
-            "id": str(uuid.uuid4()),
-            "name": company['name'],
-            "scraping_status": "GOT_COMPANY_ID",
-            "eudamed_uuid": eudamed_uuid
-        }
-        supabase.table('eudamed_companies').insert(new_record).execute()
-    
-def process_companies_for_country(iso_code):
-    page = 0
-    counter = 1
-    while True:
-        data = fetch_companies(iso_code, page)
-        
-        for company in data['content']:
-            insert_company(company, iso_code, counter)
-            counter += 1
-        
-        if data['last']:
-            break
-        
-        page += 1
-
-def get_country_iso_codes():
-    response = supabase.table('countries').select("iso_code").execute()
+
+async def requeue_changed_companies(requeue_buffer, companies):
+    # Known companies with a new version go back to GOT_COMPANY_ID, so the details stage refetches them
+    known = await fetch_known('eudamed_companies', [company['uuid'] for company in companies])
+    changed = [
+        {**company_record(company), "id": known[company['uuid']]['id']}
+        for company in companies
+        if company['uuid'] in known
+        and known[company['uuid']]['scraping_status'] != "GOT_COMPANY_ID"
+        and is_changed(known[company['uuid']], company.get('versionNumber'))
+    ]
+    await requeue_buffer.add(changed)
+
+async def process_page(client, buffer, iso_code, page, requeue_buffer=None):
+    data = await fetch_companies(client, iso_code, page)
+    if data is None or 'content' not in data:
+        print(f"Skipping {iso_code} page {page} due to connection issues.")
+        return 0
+
+    if requeue_buffer is not None:
+        await requeue_changed_companies(requeue_buffer, data['content'])
+
+    # Existing companies are left untouched (ignore_duplicates on eudamed_uuid)
+    await buffer.add([company_record(company) for company in data['content']])
+
+    return len(data['content'])
+
+async def get_country_iso_codes():
+    response = await execute(supabase.table('countries').select("iso_code"))
     return [country['iso_code'] for country in response.data]
 
-def process_all_countries():
-    iso_codes = get_country_iso_codes()
-    for iso_code in iso_codes:
-        process_companies_for_country(iso_code)
-    print("Finished processing all countries.")
+async def plan_page_jobs(client, iso_codes):
+    # Ask every country for its size first and skip the empty ones
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def count(iso_code):
+        async with semaphore:
+            return iso_code, await count_companies(client, iso_code)
+
+    counts = await asyncio.gather(*[count(iso_code) for iso_code in iso_codes])
+
+    jobs = []
+    for iso_code, total in counts:
+        if total:
+            print(f"{iso_code}: {total} companies")
+            jobs.extend((iso_code, page) for page in range(math.ceil(total / MAX_PAGE_SIZE)))
+
+    return jobs
+
+async def page_worker(client, buffer, requeue_buffer, queue, progress):
+    while True:
+        iso_code, page = await queue.get()
+        try:
+            inserted = await process_page(client, buffer, iso_code, page, requeue_buffer)
+            progress['companies'] += inserted
+            progress['pages'] += 1
+            print(f"Processed {iso_code} page {page} - {progress['pages']}/{progress['total_pages']} pages, {progress['companies']} companies so far.")
+            report_progress(**progress)
+        except Exception as e:
+            print(f"Error processing {iso_code} page {page}: {e}")
+        finally:
+            queue.task_done()
+
+async def process_all_countries():
+    # ISO codes can be passed on the command line (see sharding.py), default is every country
+    iso_codes = iso_codes_from_argv() or await get_country_iso_codes()
+
+    buffer = UpsertBuffer('eudamed_companies', on_conflict='eudamed_uuid', ignore_duplicates=True,
+                          flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL)
+    # Only used with --incremental
+    requeue_buffer = UpsertBuffer('eudamed_companies', on_conflict='eudamed_uuid',
+                                  flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL)
+
+    async with EudamedClient(limit_per_host=CONCURRENCY) as client, buffer, requeue_buffer:
+        jobs = await plan_page_jobs(client, iso_codes)
+
+        queue = asyncio.Queue()
+        for job in jobs:
+            queue.put_nowait(job)
+
+        progress = {"pages": 0, "companies": 0, "total_pages": len(jobs)}
+        workers = [
+            asyncio.create_task(page_worker(client, buffer, requeue_buffer if INCREMENTAL else None, queue, progress))
+            for _ in range(CONCURRENCY)
+        ]
+
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    print(f"Finished processing all countries. Total companies: {progress['companies']}")
+    if INCREMENTAL:
+        print(f"Companies queued for a details refetch: {requeue_buffer.written}")
 
 # Run the script
-process_all_countries()
+if __name__ == "__main__":
+    asyncio.run(process_all_countries())
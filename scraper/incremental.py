@@ -0,0 +1,28 @@
+import sys
+from db import supabase, execute
+
+# Run a list stage with --incremental to only queue new or changed entities for
+# detail fetches. The versionNumber seen on the list pages is stored in
+# listed_version_number, the detail stages store the fetched one in version_number.
+INCREMENTAL = "--incremental" in sys.argv
+
+# Max number of uuids per in_() lookup, keeps the request URL short
+ID_LOOKUP_CHUNK = 100
+
+
+async def fetch_known(table, eudamed_uuids, columns=("id", "version_number", "scraping_status")):
+    # {eudamed_uuid: row} for the uuids that are already in the table
+    known = {}
+    for i in range(0, len(eudamed_uuids), ID_LOOKUP_CHUNK):
+        existing = await execute(
+            supabase.table(table)
+            .select("eudamed_uuid", *columns)
+            .in_("eudamed_uuid", eudamed_uuids[i:i + ID_LOOKUP_CHUNK])
+        )
+        known.update({row['eudamed_uuid']: row for row in existing.data})
+    return known
+
+
+def is_changed(known_row, listed_version):
+    # New entities and entities whose list version differs from the fetched details need a (re)fetch
+    return known_row is None or listed_version is None or known_row.get('version_number') != listed_version
@@ -0,0 +1,116 @@
+import os
+import sys
+import time
+import json
+import asyncio
+import argparse
+from sharding import SHARD_ENV, PROGRESS_PREFIX, ALL_FLAG, iso_codes_from_argv, partition
+
+# Runs a script in N worker processes, each with its own HTTP and DB connection pools,
+# and merges their output and progress.
+#
+#   python scraper/launch.py -n 8 scraper/get_company_details.py              (by id, --shard=i/N)
+#   python scraper/launch.py -n 4 --by iso scraper/get_company_id.py --all    (by country)
+#   python scraper/launch.py -n 4 --by iso get_apollo_company.py FR DE AT IT
+#
+# --by id:  get_company_details, get_company_devices, get_company_devices_details, get_certificate_details
+# --by iso: get_company_id, pipeline, get_apollo_company, clean_url, ranking_score
+# With --by iso and --all instead of ISO codes, all countries are split, weighted by their number of companies.
+
+PROGRESS_INTERVAL = 10
+
+
+async def country_weights(iso_codes=None):
+    from db import supabase, execute
+
+    if not iso_codes:
+        response = await execute(supabase.table('countries').select("iso_code"))
+        iso_codes = [country['iso_code'] for country in response.data]
+
+    async def count(iso_code):
+        response = await execute(
+            supabase.table('eudamed_companies').select('id', count='exact').eq('iso_code', iso_code).limit(1)
+        )
+        return iso_code, response.count or 0
+
+    return dict(await asyncio.gather(*[count(iso_code) for iso_code in iso_codes]))
+
+
+async def plan_workers(script, script_args, processes, by):
+    # Command line of every worker
+    if by == "id":
+        return [[script, *script_args, f"--shard={i}/{processes}"] for i in range(processes)]
+
+    flags = [arg for arg in script_args if arg.startswith("-")]
+    iso_codes = iso_codes_from_argv(script_args)
+    if not iso_codes and ALL_FLAG not in script_args:
+        raise SystemExit(f"--by iso needs ISO codes or {ALL_FLAG}")
+    weights = await country_weights(iso_codes)
+    # With fewer countries than processes some shards are empty, they get no worker
+    shards = [iso_codes for iso_codes in partition(list(weights), processes, weights) if iso_codes]
+    for i, iso_codes in enumerate(shards):
+        print(f"[{i}] {', '.join(iso_codes)} ({sum(weights[iso] for iso in iso_codes)} companies)")
+    return [[script, *flags, *iso_codes] for iso_codes in shards]
+
+
+async def run_worker(index, args, progress):
+    env = {**os.environ, SHARD_ENV: str(index), "PYTHONUNBUFFERED": "1"}
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, *args, env=env, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+    )
+
+    async for line in process.stdout:
+        line = line.decode('utf-8', errors='replace').rstrip()
+        if line.startswith(PROGRESS_PREFIX):
+            try:
+                progress[index] = json.loads(line[len(PROGRESS_PREFIX):])
+            except ValueError:
+                pass
+        else:
+            print(f"[{index}] {line}")
+
+    return await process.wait()
+
+
+def merged_progress(progress):
+    totals = {}
+    for counters in progress.values():
+        for key, value in counters.items():
+            if isinstance(value, (int, float)):
+                totals[key] = totals.get(key, 0) + value
+    return ", ".join(f"{key} {value}" for key, value in totals.items())
+
+
+async def report_progress(progress, start):
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        if progress:
+            print(f"[all {time.monotonic() - start:.0f}s] {merged_progress(progress)}")
+
+
+async def launch(script, script_args, processes, by):
+    start = time.monotonic()
+    workers = await plan_workers(script, script_args, processes, by)
+
+    progress = {}
+    reporter = asyncio.create_task(report_progress(progress, start))
+    codes = await asyncio.gather(*[run_worker(i, args, progress) for i, args in enumerate(workers)])
+    reporter.cancel()
+
+    print(f"[all {time.monotonic() - start:.0f}s] Finished {len(workers)} workers. {merged_progress(progress)}")
+    failed = [i for i, code in enumerate(codes) if code != 0]
+    if failed:
+        print(f"Workers failed: {failed}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a scraper script in several processes.")
+    parser.add_argument("-n", "--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--by", choices=["id", "iso"], default="id")
+    parser.add_argument("script")
+    parser.add_argument("script_args", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+
+    sys.exit(asyncio.run(launch(args.script, args.script_args, args.processes, args.by)))
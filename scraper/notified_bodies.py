@@ -0,0 +1,100 @@
+import asyncio
+from db import supabase, execute
+
+
+def notified_body_row(notified_body):
+    notified_body_data = {
+        "eudamed_uuid": notified_body.get("uuid"),
+        "version_number": notified_body.get("versionNumber"),
+        "version_state_code": notified_body.get("versionState", {}).get("code"),
+        "latest_version": notified_body.get("latestVersion"),
+        "last_update_date": notified_body.get("lastUpdateDate"),
+        "name": notified_body.get("name"),
+        "actor_type_code": notified_body.get("actorType", {}).get("code"),
+        "actor_type_srn_code": notified_body.get("actorType", {}).get("srnCode"),
+        "actor_type_category": notified_body.get("actorType", {}).get("category"),
+        "status_code": (notified_body.get("status") or {}).get("code"),
+        "status_from_date": notified_body.get("statusFromDate"),
+        "country_iso2_code": notified_body.get("countryIso2Code"),
+        "country_name": notified_body.get("countryName"),
+        "country_type": notified_body.get("countryType"),
+        "geographical_address": notified_body.get("geographicalAddress"),
+        "electronic_mail": notified_body.get("electronicMail"),
+        "telephone": notified_body.get("telephone"),
+        "srn": notified_body.get("srn"),
+        "json_dump": notified_body,
+    }
+
+    # Remove None values from the update dictionary
+    return {k: v for k, v in notified_body_data.items() if v is not None}
+
+
+class NotifiedBodyRegistry:
+    """
+    In-memory eudamed_uuid -> (id, version_number) map of the eudamed_notified_bodies table.
+
+    There are only a few dozen notified bodies but one per certificate, so resolve()
+    only upserts a body that is new or has a newer versionNumber than the stored one,
+    and otherwise returns the known id. load() preloads the table, so this also holds across runs.
+    """
+
+    def __init__(self):
+        self.bodies = {}
+        self.upserts = 0
+        self.lock = asyncio.Lock()
+
+    async def load(self, page_size=1000):
+        from_ = 0
+        while True:
+            response = await execute(
+                supabase.table('eudamed_notified_bodies')
+                .select('id', 'eudamed_uuid', 'version_number')
+                .order('id')
+                .range(from_, from_ + page_size - 1)
+            )
+            for body in response.data:
+                self.bodies[body['eudamed_uuid']] = (body['id'], body['version_number'])
+
+            if len(response.data) < page_size:
+                break
+            from_ += page_size
+
+        print(f"Loaded {len(self.bodies)} notified bodies.")
+
+    def known_id(self, notified_body):
+        known = self.bodies.get(notified_body.get("uuid"))
+        if known is None:
+            return None
+        # Certificates embed the body as of their own version, older snapshots never overwrite a newer one
+        body_id, version = known
+        incoming = notified_body.get("versionNumber")
+        if incoming is not None and (version is None or incoming > version):
+            return None
+        return body_id
+
+    async def resolve(self, notified_body):
+        # id of the notified body, upserted first if it is new or changed
+        if not notified_body or not notified_body.get("uuid"):
+            return None
+
+        body_id = self.known_id(notified_body)
+        if body_id is not None:
+            return body_id
+
+        async with self.lock:
+            # Another task may have upserted it while we waited
+            body_id = self.known_id(notified_body)
+            if body_id is not None:
+                return body_id
+
+            response = await execute(
+                supabase.table('eudamed_notified_bodies')
+                .upsert(notified_body_row(notified_body), on_conflict="eudamed_uuid")
+            )
+            self.upserts += 1
+            if not response.data:
+                return None
+
+            body = response.data[0]
+            self.bodies[body['eudamed_uuid']] = (body['id'], body.get('version_number'))
+            return body['id']
@@ -0,0 +1,213 @@
+import time
+import asyncio
+from db import supabase, execute
+from postgrest.types import ReturnMethod
+from eudamed_client import EudamedClient
+from response_cache import ResponseCache
+from incremental import INCREMENTAL, fetch_known, is_changed
+from get_company_id import fetch_companies, plan_page_jobs, get_country_iso_codes, company_record
+from get_company_details import cities, process_companies_batch, contacts_buffer
+from get_company_devices import process_company_devices
+from get_company_devices_details import process_products_batch
+from sharding import iso_codes_from_argv, report_progress
+
+# Runs COMPANY_ID -> COMPANY_DETAILS -> COMPANY_DEVICE_ID -> COMPANY_DEVICE_DETAILS in one process.
+# The stages are connected by bounded queues instead of polling the DB for the previous status,
+# so a company found on an /eos page goes straight on to its details, devices and device details.
+# A full queue blocks the stage in front of it (backpressure), which keeps memory flat.
+#
+#   python scraper/pipeline.py [--incremental] [ISO codes, default is every country]
+#
+# Rows left behind by an interrupted run are picked up by the single stage scripts.
+
+# Workers per stage
+PAGE_WORKERS = 5
+DETAIL_WORKERS = 20
+DEVICE_WORKERS = 10
+PRODUCT_WORKERS = 4
+
+# Queue sizes between the stages
+COMPANY_QUEUE_SIZE = 600
+DEVICE_QUEUE_SIZE = 100
+PRODUCT_QUEUE_SIZE = 1000
+
+# Company details are written in batches of up to DETAIL_BATCH_SIZE queued companies (one contacts upsert each),
+# device details in batches of up to PRODUCT_BATCH_SIZE queued products
+DETAIL_BATCH_SIZE = 25
+PRODUCT_BATCH_SIZE = 50
+
+PROGRESS_INTERVAL = 10
+
+
+async def route_companies(companies, details_queue, devices_queue):
+    # New companies are inserted and sent to the details stage. Known ones continue
+    # at the stage their status says, unchanged finished companies are skipped.
+    known = await fetch_known(
+        'eudamed_companies',
+        [company['uuid'] for company in companies],
+        columns=("id", "version_number", "scraping_status", "eudamed_identifier")
+    )
+
+    new_rows, changed_rows, for_details, for_devices = [], [], [], []
+    for company in companies:
+        row = known.get(company['uuid'])
+        if row is None:
+            record = company_record(company)
+            new_rows.append(record)
+            for_details.append(record)
+        elif INCREMENTAL and row['scraping_status'] != "GOT_COMPANY_ID" and is_changed(row, company.get('versionNumber')):
+            record = {**company_record(company), "id": row['id']}
+            changed_rows.append(record)
+            for_details.append(record)
+        elif row['scraping_status'] in ("GOT_COMPANY_ID", "ERROR"):
+            for_details.append({**company_record(company), "id": row['id']})
+        elif row['scraping_status'] == "GOT_COMPANY_DETAILS":
+            for_devices.append({"id": row['id'], "eudamed_identifier": row['eudamed_identifier']})
+
+    # Written before they are queued, the later stages update these rows by id
+    if new_rows:
+        await execute(
+            supabase.table('eudamed_companies')
+            .upsert(new_rows, on_conflict="eudamed_uuid", ignore_duplicates=True, returning=ReturnMethod.minimal)
+        )
+    if changed_rows:
+        await execute(
+            supabase.table('eudamed_companies')
+            .upsert(changed_rows, on_conflict="eudamed_uuid", returning=ReturnMethod.minimal)
+        )
+
+    for company in for_details:
+        await details_queue.put(company)
+    for company in for_devices:
+        await devices_queue.put(company)
+
+    return len(new_rows)
+
+
+async def page_worker(client, pages_queue, details_queue, devices_queue, progress):
+    while True:
+        iso_code, page = await pages_queue.get()
+        try:
+            data = await fetch_companies(client, iso_code, page)
+            if data is None or 'content' not in data:
+                print(f"Skipping {iso_code} page {page} due to connection issues.")
+            else:
+                new = await route_companies(data['content'], details_queue, devices_queue)
+                progress['new_companies'] += new
+            progress['pages'] += 1
+        except Exception as e:
+            print(f"Error processing {iso_code} page {page}: {e}")
+        finally:
+            pages_queue.task_done()
+
+
+async def detail_worker(client, contacts, details_queue, devices_queue, progress):
+    while True:
+        # Wait for one company, then take whatever else is queued up to a full batch
+        companies = [await details_queue.get()]
+        while len(companies) < DETAIL_BATCH_SIZE and not details_queue.empty():
+            companies.append(details_queue.get_nowait())
+        try:
+            results = await process_companies_batch(client, companies, contacts)
+            for company, details in zip(companies, results):
+                progress['company_details'] += 1
+                srn = ((details or {}).get('actorDataPublicView') or {}).get('eudamedIdentifier')
+                if srn:
+                    await devices_queue.put({"id": company['id'], "eudamed_identifier": srn})
+        except Exception as e:
+            print(f"Error processing details of {len(companies)} companies: {e}")
+        finally:
+            for _ in companies:
+                details_queue.task_done()
+
+
+async def device_worker(client, devices_queue, products_queue, progress):
+    while True:
+        company = await devices_queue.get()
+        try:
+            await process_company_devices(client, company, products_queue)
+            progress['company_devices'] += 1
+        except Exception as e:
+            print(f"Error processing devices of company {company['id']}: {e}")
+        finally:
+            devices_queue.task_done()
+
+
+async def product_worker(client, products_queue, progress):
+    while True:
+        # Wait for one product, then take whatever else is queued up to a full batch
+        products = [await products_queue.get()]
+        while len(products) < PRODUCT_BATCH_SIZE and not products_queue.empty():
+            products.append(products_queue.get_nowait())
+        try:
+            await process_products_batch(client, products)
+            progress['device_details'] += len(products)
+        except Exception as e:
+            print(f"Error processing device details batch: {e}")
+        finally:
+            for _ in products:
+                products_queue.task_done()
+
+
+async def print_progress(progress, queues):
+    start = time.monotonic()
+    while True:
+        await asyncio.sleep(PROGRESS_INTERVAL)
+        sizes = ", ".join(f"{name} {queue.qsize()}" for name, queue in queues.items())
+        print(
+            f"[{time.monotonic() - start:.0f}s] pages {progress['pages']}/{progress['total_pages']}, "
+            f"new companies {progress['new_companies']}, company details {progress['company_details']}, "
+            f"company devices {progress['company_devices']}, device details {progress['device_details']} "
+            f"(queued: {sizes})"
+        )
+        report_progress(**progress)
+
+
+async def run_pipeline(iso_codes=None):
+    await cities.load()
+    if iso_codes is None:
+        iso_codes = await get_country_iso_codes()
+
+    pages_queue = asyncio.Queue()
+    details_queue = asyncio.Queue(COMPANY_QUEUE_SIZE)
+    devices_queue = asyncio.Queue(DEVICE_QUEUE_SIZE)
+    products_queue = asyncio.Queue(PRODUCT_QUEUE_SIZE)
+    progress = {
+        "pages": 0, "total_pages": 0, "new_companies": 0, "company_details": 0,
+        "company_devices": 0, "device_details": 0
+    }
+
+    async with EudamedClient(cache=ResponseCache()) as client, contacts_buffer() as contacts:
+        jobs = await plan_page_jobs(client, iso_codes)
+        for job in jobs:
+            pages_queue.put_nowait(job)
+        progress['total_pages'] = len(jobs)
+
+        workers = [
+            *[asyncio.create_task(page_worker(client, pages_queue, details_queue, devices_queue, progress)) for _ in range(PAGE_WORKERS)],
+            *[asyncio.create_task(detail_worker(client, contacts, details_queue, devices_queue, progress)) for _ in range(DETAIL_WORKERS)],
+            *[asyncio.create_task(device_worker(client, devices_queue, products_queue, progress)) for _ in range(DEVICE_WORKERS)],
+            *[asyncio.create_task(product_worker(client, products_queue, progress)) for _ in range(PRODUCT_WORKERS)],
+            asyncio.create_task(print_progress(progress, {
+                "details": details_queue, "devices": devices_queue, "device details": products_queue
+            })),
+        ]
+
+        # Each queue is only drained once everything upstream of it is done
+        for queue in (pages_queue, details_queue, devices_queue, products_queue):
+            await queue.join()
+
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    report_progress(**progress)
+    print(
+        f"Finished pipeline. New companies: {progress['new_companies']}, company details: {progress['company_details']}, "
+        f"company devices: {progress['company_devices']}, device details: {progress['device_details']}"
+    )
+
+
+# Run the script
+if __name__ == "__main__":
+    asyncio.run(run_pipeline(iso_codes_from_argv() or None))
@@ -0,0 +1,153 @@
+import os
+import gzip
+import time
+import asyncio
+import hashlib
+import threading
+import uuid
+from json_codec import loads, dumps
+
+# Cached detail payloads live next to the sample payloads in eudamed_responses/
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'eudamed_responses', 'cache')
+
+
+def payload_version(data):
+    # versionNumber sits at the top level for devices and certificates, under actorDataPublicView for actors
+    if not isinstance(data, dict):
+        return None
+    if data.get('versionNumber') is not None:
+        return data['versionNumber']
+    return (data.get('actorDataPublicView') or {}).get('versionNumber')
+
+
+class ResponseCache:
+    """
+    Gzip-compressed on-disk cache of EUDAMED detail responses.
+
+    Entries are keyed by the sha256 of the request URL and store the payload's
+    versionNumber. A lookup with a version only hits if the cached payload has
+    that version; entries older than ttl seconds are dropped, and the oldest
+    entries are evicted once the cache grows past max_bytes.
+
+    The directory is only walked by open() and close() (EudamedClient calls them
+    on enter / exit). In between the size is tracked per write, and the cache is
+    only walked again if that estimate goes over max_bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, ttl=30 * 24 * 3600, max_bytes=5 * 1024 ** 3):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.size = None
+        self.evict_lock = threading.Lock()
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def path(self, url):
+        digest = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest[:2], f"{digest}.json.gz")
+
+    def read(self, url, version=None):
+        path = self.path(url)
+        try:
+            if self.ttl and time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with gzip.open(path, 'rb') as file:
+                entry = loads(file.read())
+        except (OSError, ValueError):
+            return None
+
+        if version is not None and entry.get('version') != version:
+            return None
+        return entry['data']
+
+    def write(self, url, data):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        entry = {"url": url, "version": payload_version(data), "fetched_at": time.time(), "data": data}
+        # Unique per write, threads of one process and other processes may write the same URL
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with gzip.open(tmp_path, 'wb') as file:
+            file.write(dumps(entry).encode('utf-8'))
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        written = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)
+
+        self.writes += 1
+        if self.size is None:
+            # Used without open(), the first write takes the initial walk
+            self.evict()
+        else:
+            self.size += written - replaced
+            if self.size > self.max_bytes:
+                self.evict()
+
+    def evict(self):
+        # Drop expired entries, then the least recently written ones until we are under max_bytes.
+        # Only one thread walks the cache, the others keep writing meanwhile.
+        if not self.evict_lock.acquire(blocking=False):
+            return
+        try:
+            self.size = self.evict_files()
+        finally:
+            self.evict_lock.release()
+
+    def evict_files(self):
+        # Returns the size of the cache after eviction
+        files = []
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                # Files of writes in progress
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if self.ttl and now - stat.st_mtime > self.ttl:
+                    # read() or another process may have removed it meanwhile
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                else:
+                    files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        return total
+
+    async def open(self):
+        await asyncio.to_thread(self.evict)
+
+    async def close(self):
+        await asyncio.to_thread(self.evict)
+
+    async def get(self, url, version=None):
+        data = await asyncio.to_thread(self.read, url, version)
+        if data is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return data
+
+    async def set(self, url, data):
+        # Error payloads (httpStatusCode) are never cached
+        if not isinstance(data, dict) or 'httpStatusCode' in data:
+            return
+        await asyncio.to_thread(self.write, url, data)
@@ -0,0 +1,104 @@
+import os
+import sys
+import json
+
+# Helpers for running a script as one of several worker processes (see launch.py).
+#
+# By country: the ISO codes are passed as positional arguments, e.g.
+#   python get_apollo_company.py FR DE
+# --all runs a script on every country instead of its default one.
+# By id: --shard=i/N selects the i-th of N equal ranges of the (uuid4) id space,
+# so every row is handled by exactly one process, e.g.
+#   python scraper/get_company_details.py --shard=2/8
+
+# Set by launch.py in every worker, switches report_progress to machine-readable lines
+SHARD_ENV = "MEDMAP_SHARD"
+PROGRESS_PREFIX = "@progress "
+
+# ids are uuid4, shards split the range of their first 32 bits
+ID_SPACE = 2 ** 32
+
+ALL_FLAG = "--all"
+
+
+def iso_codes_from_argv(argv=None):
+    # Positional arguments are ISO codes, flags (--incremental, --shard=...) are skipped
+    argv = sys.argv[1:] if argv is None else argv
+    return [arg.upper() for arg in argv if not arg.startswith("-")]
+
+
+def countries_from_argv(default, argv=None):
+    # ISO codes from the command line, None (every country) with --all, [default] otherwise
+    argv = sys.argv[1:] if argv is None else argv
+    iso_codes = iso_codes_from_argv(argv)
+    if iso_codes:
+        return iso_codes
+    if ALL_FLAG in argv:
+        return None
+    return [default]
+
+
+def parse_shard(argv=None):
+    # (index, count) from --shard=i/N, (0, 1) when the script runs on its own
+    argv = sys.argv[1:] if argv is None else argv
+    for arg in argv:
+        if arg.startswith("--shard="):
+            index, count = arg.split("=", 1)[1].split("/")
+            index, count = int(index), int(count)
+            if not 0 <= index < count:
+                raise ValueError(f"Invalid shard {arg}")
+            return index, count
+    return 0, 1
+
+
+def id_bounds(index, count):
+    # [lower, upper) uuid bounds of a shard, None for an open end
+    def bound(i):
+        return f"{i * ID_SPACE // count:08x}-0000-0000-0000-000000000000"
+
+    lower = bound(index) if index > 0 else None
+    upper = bound(index + 1) if index < count - 1 else None
+    return lower, upper
+
+
+def shard_filter(where=None, argv=None):
+    """
+    Add this process's id range to an iter_chunks filter.
+
+    Usage:
+        iter_chunks('eudamed_products', columns, shard_filter(lambda q: q.eq('scraping_status', ...)))
+    """
+    index, count = parse_shard(argv)
+    if count == 1:
+        return where
+
+    lower, upper = id_bounds(index, count)
+
+    def where_in_shard(query):
+        if where is not None:
+            query = where(query)
+        if lower is not None:
+            query = query.gte('id', lower)
+        if upper is not None:
+            query = query.lt('id', upper)
+        return query
+
+    return where_in_shard
+
+
+def partition(items, count, weights=None):
+    # Deterministic split into count lists with similar total weight (largest first, to the lightest list)
+    weights = weights or {}
+    shards = [[] for _ in range(count)]
+    loads = [0] * count
+    for item in sorted(items, key=lambda item: (-weights.get(item, 0), item)):
+        i = loads.index(min(loads))
+        shards[i].append(item)
+        loads[i] += weights.get(item, 0) + 1
+    return shards
+
+
+def report_progress(**counters):
+    # Under launch.py the counters are merged across workers, on its own this is a no-op
+    if os.environ.get(SHARD_ENV):
+        print(PROGRESS_PREFIX + json.dumps(counters), flush=True)
@@ -0,0 +1,80 @@
+import re
+import sys
+import json
+import time
+from persistent_cache import PersistentCache, MISSING
+
+# Shared by fetch_company_websites and bing_get_company_empl_llm (cache/search_results.sqlite3)
+SEARCH_CACHE_NAME = 'search_results'
+SEARCH_CACHE_TTL = 90 * 24 * 3600
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query):
+    # "ACME  GmbH official Website " and "acme gmbh official website" are the same search
+    return WHITESPACE.sub(" ", query).strip().lower()
+
+
+class SearchCache:
+    """
+    Persistent cache of web search results (Bing webPages.value), keyed by the
+    normalized query and the market.
+
+    Entries older than ttl seconds count as missing. hits / misses are counted
+    per instance, warm() loads results from a JSONL file.
+
+    Usage:
+        results = search_cache.get(query, market)
+        if results is MISSING:
+            results = search(query)
+            search_cache.set(query, market, results)
+    """
+
+    def __init__(self, name=SEARCH_CACHE_NAME, ttl=SEARCH_CACHE_TTL):
+        self.store = PersistentCache(name)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, query, market=None):
+        return f"{market or 'default'}|{normalize_query(query)}"
+
+    def get(self, query, market=None):
+        entry = self.store.get(self.key(query, market))
+        if entry is MISSING or (self.ttl and time.time() - entry['fetched_at'] > self.ttl):
+            self.misses += 1
+            return MISSING
+        self.hits += 1
+        return entry['results']
+
+    def set(self, query, market, results, fetched_at=None):
+        self.store.set(self.key(query, market), {"fetched_at": fetched_at or time.time(), "results": results})
+
+    def warm(self, path):
+        # One {"query": ..., "market": ..., "results": [...], "fetched_at": ...} object per line, market / fetched_at optional
+        entries = {}
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                entries[self.key(item['query'], item.get('market'))] = {
+                    "fetched_at": item.get('fetched_at') or time.time(),
+                    "results": item['results'],
+                }
+        self.store.set_many(entries)
+        return len(entries)
+
+    def stats(self):
+        total = self.hits + self.misses
+        rate = f"{self.hits / total:.0%}" if total else "-"
+        return f"search cache: {self.hits} hits, {self.misses} misses ({rate} hit rate)"
+
+
+if __name__ == "__main__":
+    # Pre-warm the cache: python search_cache.py warm results.jsonl
+    if len(sys.argv) != 3 or sys.argv[1] != "warm":
+        print("Usage: python search_cache.py warm <file.jsonl>")
+        sys.exit(1)
+    print(f"Loaded {SearchCache().warm(sys.argv[2])} search results into the cache.")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts import their neighbours by module name (from db import ..., from persistent_cache import ...)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "scraper")]
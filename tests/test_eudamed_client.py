@@ -0,0 +1,63 @@
+import asyncio
+from aiohttp import web
+import eudamed_client
+from eudamed_client import EudamedClient
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_get("/{tail:.*}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def run(handler, request, monkeypatch):
+    async def main():
+        runner, url = await serve(handler)
+        monkeypatch.setattr(eudamed_client, "base_url", url)
+        try:
+            async with EudamedClient(retries=3, retry_delay=0) as client:
+                return await request(client)
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_error_page_is_retried_then_none(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        return web.Response(status=502, text="<html>Bad Gateway</html>", content_type="text/html")
+
+    assert run(handler, lambda client: client.get_device("uuid-1"), monkeypatch) is None
+    assert len(calls) == 3
+    assert run(handler, lambda client: client.list_devices("SRN-1"), monkeypatch) is None
+
+
+def test_html_body_with_200_is_retried(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        if len(calls) == 1:
+            return web.Response(text="<html>maintenance</html>", content_type="text/html")
+        return web.json_response({"content": [{"uuid": "a"}], "last": True})
+
+    assert run(handler, lambda client: client.list_actors("AT"), monkeypatch) == {"content": [{"uuid": "a"}], "last": True}
+    assert len(calls) == 2
+
+
+def test_not_found_is_not_retried(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        return web.json_response({"error": "not found"}, status=404)
+
+    assert run(handler, lambda client: client.get_actor("uuid-1"), monkeypatch) is None
+    assert len(calls) == 1
@@ -0,0 +1,34 @@
+import json
+from llm_batch import read_answers, batch_mode_from_argv
+
+
+def result_line(custom_id, content=None, status_code=200, error=None, body=None):
+    if body is None:
+        body = {"choices": [{"message": {"role": "assistant", "content": content}}]}
+    return json.dumps({
+        "id": f"batch_req_{custom_id}",
+        "custom_id": custom_id,
+        "response": None if error else {"status_code": status_code, "body": body},
+        "error": error,
+    })
+
+
+def test_read_answers_skips_failed_and_malformed_lines(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text("\n".join([
+        result_line("company-1", " acme.com \n"),
+        result_line("company-2", error={"code": "server_error", "message": "failed"}),
+        result_line("company-3", status_code=500, body={"error": {"message": "failed"}}),
+        result_line("company-4", body={"choices": []}),
+        "{not json",
+        "",
+        result_line("company-5", "N/A"),
+    ]) + "\n", encoding="utf-8")
+
+    assert read_answers(str(path)) == {"company-1": "acme.com", "company-5": "N/A"}
+
+
+def test_batch_mode_from_argv():
+    assert batch_mode_from_argv(["CH", "--write-batch=jobs/ch.jsonl"]) == ("write", "jobs/ch.jsonl")
+    assert batch_mode_from_argv(["--apply-batch=jobs/ch.out.jsonl"]) == ("apply", "jobs/ch.out.jsonl")
+    assert batch_mode_from_argv(["CH"]) == (None, None)
@@ -0,0 +1,90 @@
+import json
+import asyncio
+from aiohttp import web
+from llm_client import LLMClient
+
+
+def completion(content):
+    return web.json_response({
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "gpt-4o-mini",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+    })
+
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/v1"
+
+
+def run(handler, use, monkeypatch):
+    async def main():
+        runner, url = await serve(handler)
+        monkeypatch.setenv("OPENAI_BASE_URL", url)
+        monkeypatch.setenv("OPENAI_API_KEY", "test")
+        try:
+            async with LLMClient(timeout=5, retries=2) as llm:
+                return await use(llm), llm
+        finally:
+            await runner.cleanup()
+    return asyncio.run(main())
+
+
+def test_packed_questions_share_one_request(monkeypatch):
+    packs = []
+
+    async def handler(request):
+        body = await request.json()
+        questions = json.loads(body["messages"][1]["content"])
+        packs.append(questions)
+        # The model leaves out the last question of a pack, it is asked again on its own
+        answered = dict(list(questions.items())[:-1]) if len(questions) > 1 else questions
+        return completion(json.dumps({"answers": {i: question.upper() for i, question in answered.items()}}))
+
+    async def use(llm):
+        packed = llm.packed("Uppercase every input.", pack_size=3)
+        return await asyncio.gather(*[packed.ask(question) for question in ["a", "b", "c"]])
+
+    answers, llm = run(handler, use, monkeypatch)
+    assert answers == ["A", "B", "C"]
+    assert packs == [{"0": "a", "1": "b", "2": "c"}, {"0": "c"}]
+    assert llm.requests == 2
+    assert llm.prompt_tokens == 20
+
+
+def test_unreadable_answer_falls_back_to_none(monkeypatch):
+    async def handler(request):
+        return completion("not json")
+
+    async def use(llm):
+        packed = llm.packed("Uppercase every input.", pack_size=2)
+        return await asyncio.gather(packed.ask("a"), packed.ask("b"))
+
+    answers, llm = run(handler, use, monkeypatch)
+    # One pack, then every question on its own
+    assert answers == [None, None]
+    assert llm.requests == 3
+
+
+def test_rate_limit_is_retried(monkeypatch):
+    calls = []
+
+    async def handler(request):
+        calls.append(request.path)
+        if len(calls) == 1:
+            return web.json_response({"error": {"message": "rate limited"}}, status=429)
+        return completion("acme.com")
+
+    answer, llm = run(handler, lambda llm: llm.complete([{"role": "user", "content": "website?"}]), monkeypatch)
+    assert answer == "acme.com"
+    assert len(calls) == 2
+    assert llm.failures == 1
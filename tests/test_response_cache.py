@@ -0,0 +1,43 @@
+import os
+import asyncio
+from response_cache import ResponseCache
+
+
+def cache_files(directory):
+    return sorted(name for _, _, names in os.walk(directory) for name in names)
+
+
+def cache_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def test_size_is_tracked_per_write(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path))
+    asyncio.run(cache.open())
+    assert cache.size == 0
+
+    cache.write("https://example.org/a", {"versionNumber": 1, "text": "a" * 100})
+    cache.write("https://example.org/b", {"versionNumber": 1, "text": "b" * 100})
+    assert cache.size == cache_size(tmp_path)
+
+    # Rewriting a URL replaces its file, only the difference counts
+    cache.write("https://example.org/a", {"versionNumber": 2, "text": "a" * 1000})
+    assert cache.size == cache_size(tmp_path)
+
+
+def test_oldest_entries_are_evicted_over_max_bytes(tmp_path):
+    cache = ResponseCache(directory=str(tmp_path), ttl=None, max_bytes=10 ** 6)
+    asyncio.run(cache.open())
+    for i in range(3):
+        cache.write(f"https://example.org/{i}", {"versionNumber": i, "text": os.urandom(200).hex()})
+        path = cache.path(f"https://example.org/{i}")
+        os.utime(path, (1000 + i, 1000 + i))
+    assert len(cache_files(tmp_path)) == 3
+
+    # Room for three entries (plus a little slack for size differences): the next write goes over the
+    # estimate and evicts the oldest one
+    cache.max_bytes = cache.size + 50
+    cache.write("https://example.org/3", {"versionNumber": 3, "text": os.urandom(200).hex()})
+    assert cache.read("https://example.org/0") is None
+    assert all(cache.read(f"https://example.org/{i}") is not None for i in (1, 2, 3))
+    assert cache.size <= cache.max_bytes
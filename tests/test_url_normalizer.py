@@ -0,0 +1,32 @@
+import pytest
+import url_normalizer
+from url_normalizer import normalize_website
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("https://www.Domain.com/en/", "domain.com"),
+    ("domain.at", "domain.at"),
+    ("www.medical.siemens.com", "medical.siemens.com"),
+    ("shop.domain.co.uk", "shop.domain.co.uk"),
+    ("acme.wixsite.com", "acme.wixsite.com"),
+    ("https://acme.blogspot.com/", "acme.blogspot.com"),
+    ("www.acme.com, acme.com", "acme.com"),
+    # The path may be what names the company, that's for the LLM
+    ("https://sites.google.com/view/acme", None),
+    # Several hosts, placeholders, bare suffixes and addresses
+    ("a.com; b.com", None),
+    ("blogspot.com", None),
+    ("co.uk", None),
+    ("http://192.168.0.1", None),
+    ("n/a", None),
+])
+def test_normalize_website(raw, expected):
+    assert normalize_website(raw) == expected
+
+
+def test_without_tldextract(monkeypatch):
+    monkeypatch.setattr(url_normalizer, "tldextract", None)
+    assert normalize_website("www.medical.siemens.com") == "medical.siemens.com"
+    assert normalize_website("https://shop.domain.co.uk/en") is None
+    assert normalize_website("https://domain.co.uk/en") == "domain.co.uk"
+    assert normalize_website("co.uk") is None
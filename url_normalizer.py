@@ -0,0 +1,115 @@
+import re
+import ipaddress
+from urllib.parse import urlsplit
+
+# tldextract parses hosts with the public suffix list (its bundled snapshot, nothing is
+# downloaded at runtime). The private section is included, so hosting platforms like
+# blogspot.com or wixsite.com count as suffixes. Without tldextract a short list of common
+# multi-label suffixes is used.
+try:
+    import tldextract
+    extract = tldextract.TLDExtract(suffix_list_urls=(), include_psl_private_domains=True)
+except ImportError:
+    tldextract = None
+
+MULTI_LABEL_SUFFIXES = {
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "me.uk", "ltd.uk", "plc.uk",
+    "co.at", "or.at", "ac.at", "gv.at",
+    "com.au", "net.au", "org.au", "co.nz", "co.za", "co.il", "org.il", "co.jp", "co.kr", "co.in",
+    "com.tr", "com.pl", "com.br", "com.cn", "com.hk", "com.sg", "com.tw", "com.mx", "com.ar",
+    "com.cy", "com.mt", "com.gr", "com.pt", "com.es", "com.ua", "com.ru",
+}
+
+# Separators between several values in one website field
+SEPARATORS = re.compile(r"[\s,;|]+")
+LABEL = re.compile(r"^(?!-)[a-z0-9¡-￿-]{1,63}(?<!-)$")
+TLD = re.compile(r"^([a-z¡-￿]{2,63}|xn--[a-z0-9-]{1,59})$")
+WWW = re.compile(r"^www\d*\.")
+
+
+def host_of(value):
+    # Host of a URL with or without scheme, None if it has none
+    if "://" not in value:
+        value = f"http://{value}"
+    try:
+        host = urlsplit(value).hostname
+    except ValueError:
+        return None
+    return host.rstrip(".") if host else None
+
+
+def clean_host(host):
+    # The host without "www.", None if it isn't a valid public host name. The public suffix
+    # list only validates, subdomains are kept: "www.medical.siemens.com" -> "medical.siemens.com"
+    host = WWW.sub("", host.lower())
+    try:
+        ipaddress.ip_address(host)
+        return None
+    except ValueError:
+        pass
+
+    labels = host.split(".")
+    if len(labels) < 2 or not all(LABEL.match(label) for label in labels) or not TLD.match(labels[-1]):
+        return None
+
+    if tldextract is not None:
+        parts = extract(host)
+        # A bare suffix ("co.uk", "blogspot.com") is no company's host
+        if not parts.domain or not parts.suffix:
+            return None
+    elif host in MULTI_LABEL_SUFFIXES:
+        return None
+    return host
+
+
+def has_subdomain(host):
+    # sub.domain.com, acme.sites.example.com - but not acme.blogspot.com (blogspot.com is a suffix)
+    if tldextract is not None:
+        return bool(extract(host).subdomain)
+    labels = host.split(".")
+    return len(labels) > (3 if ".".join(labels[-2:]) in MULTI_LABEL_SUFFIXES else 2)
+
+
+def path_of(value):
+    if "://" not in value:
+        value = f"http://{value}"
+    try:
+        return urlsplit(value).path.strip("/")
+    except ValueError:
+        return ""
+
+
+def has_domain(raw):
+    # Placeholders like "n/a" or "No website" contain no domain at all
+    return bool(raw) and "." in raw
+
+
+def normalize_website(raw):
+    """
+    Deterministic clean-up of a website field to its host, without scheme, "www." and path:
+    "https://www.Domain.com/en/" -> "domain.com", "shop.domain.co.uk" -> "shop.domain.co.uk".
+
+    Returns None when the value needs a closer look (several different hosts, a part
+    that looks like a host but isn't valid, or a path on a subdomain like
+    "sites.google.com/view/acme" where the path may name the company), the caller
+    falls back to the LLM.
+    """
+    if not raw or not raw.strip():
+        return None
+
+    hosts = set()
+    for part in SEPARATORS.split(raw.strip()):
+        host = host_of(part) if "." in part else None
+        if host is None:
+            # Words like "(main)" between the values are ignored
+            if "." in part:
+                return None
+            continue
+        cleaned = clean_host(host)
+        if cleaned is None or (path_of(part) and has_subdomain(cleaned)):
+            return None
+        hosts.add(cleaned)
+
+    if len(hosts) != 1:
+        return None
+    return hosts.pop()